@@ -1,15 +1,15 @@
 import cv2
 import numpy as np
+import io
 import os
 import argparse
 from pathlib import Path
 import time
 from typing import Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import logging
-from scipy import ndimage
-from skimage import restoration, filters, exposure
-from skimage.morphology import disk
-from skimage.filters import unsharp_mask
+from PIL import Image
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,6 +20,10 @@ class ImageUpscaler:
     Advanced AI-Powered Image Upscaler with quality enhancement
     """
     
+    # 3x3 kernels shared by the detail and texture stages
+    SHARPEN_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], dtype=np.float32)
+    HIGH_PASS_KERNEL = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]], dtype=np.float32)
+    
     def __init__(self):
         self.interpolation_methods = {
             'cubic': cv2.INTER_CUBIC,
@@ -30,6 +34,27 @@ class ImageUpscaler:
             'ai_enhanced': 'ai_enhanced',
             'super_resolution': 'super_resolution'
         }
+        self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        
+        # Optional CUDA pipeline for AI enhancement, used when OpenCV was built
+        # with CUDA and a device is present
+        self._use_cuda = False
+        try:
+            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+                self._cuda_gaussian = cv2.cuda.createGaussianFilter(cv2.CV_8UC1, cv2.CV_8UC1, (13, 13), 2.0)
+                self._cuda_sharpen = cv2.cuda.createLinearFilter(cv2.CV_8UC1, cv2.CV_8UC1, self.SHARPEN_KERNEL)
+                self._cuda_clahe = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+                self._use_cuda = True
+                logger.info("CUDA device found, AI enhancement will run on the GPU")
+        except (AttributeError, cv2.error) as e:
+            logger.debug(f"CUDA unavailable: {e}")
+        
+        # OpenCL T-API: wrapping images in cv2.UMat lets OpenCV dispatch the
+        # CPU pipelines to an OpenCL device without separate code paths
+        self._use_opencl = cv2.ocl.haveOpenCL()
+        if self._use_opencl:
+            cv2.ocl.setUseOpenCL(True)
+            logger.info("OpenCL available, AI pipelines will use the T-API")
         
     def validate_input(self, input_path: str) -> bool:
         """Validate input file exists and is a valid image"""
@@ -37,9 +62,10 @@ class ImageUpscaler:
             logger.error(f"Input file does not exist: {input_path}")
             return False
             
-        # Check if it's a valid image by trying to read it
+        # Check if it's a valid image by trying to read it (at 1/8 scale, which
+        # is enough to prove the file decodes)
         try:
-            test_img = cv2.imread(input_path)
+            test_img = cv2.imread(input_path, cv2.IMREAD_REDUCED_COLOR_8)
             if test_img is None:
                 logger.error(f"Invalid image file: {input_path}")
                 return False
@@ -55,73 +81,105 @@ class ImageUpscaler:
         logger.info("Applying AI-powered enhancement...")
         
         try:
-            # Use faster OpenCV-based enhancement instead of scikit-image
+            # Work in LAB throughout: luminance carries the detail, so every
+            # filter runs on the single L channel and colour is converted once
+            # in each direction. UMat has no shape, so take the size up front.
+            # The whole image is processed at once: OpenCV's filters already
+            # stream rows in cache-sized bands across threads, 512px tiles with
+            # a 16px halo measured slower, and CLAHE is not tile-local
+            height, width = img.shape[:2]
+            src = cv2.UMat(img) if self._use_opencl else img
+            lab_l, lab_a, lab_b = cv2.split(cv2.cvtColor(src, cv2.COLOR_BGR2LAB))
+            
             # Step 1: Noise reduction using bilateral filter
-            img_denoised = cv2.bilateralFilter(img, 9, 75, 75)
+            lab_l = self._denoise_bilateral(lab_l, scale_factor, (width, height))
             
             # Step 2: Edge enhancement using unsharp masking
-            gaussian = cv2.GaussianBlur(img_denoised, (0, 0), 2.0)
-            img_enhanced = cv2.addWeighted(img_denoised, 1.5, gaussian, -0.5, 0)
-            
-            # Step 3: Contrast enhancement using CLAHE
-            lab = cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2LAB)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            lab[:,:,0] = clahe.apply(lab[:,:,0])
-            img_contrast = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+            gaussian = cv2.GaussianBlur(lab_l, (0, 0), 2.0)
+            lab_l = cv2.addWeighted(lab_l, 1.5, gaussian, -0.5, 0)
+            
+            # Step 3: Contrast enhancement using CLAHE (~32px tiles on small
+            # images, where an 8x8 grid would degenerate)
+            if min(height, width) < 256:
+                tile_grid = (max(1, width // 32), max(1, height // 32))
+                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=tile_grid)
+            else:
+                clahe = self._clahe
+            lab_l = clahe.apply(lab_l)
             
-            # Step 4: Detail enhancement using morphological operations
-            img_detail = self._enhance_details_fast(img_contrast)
+            # Step 4: Detail enhancement
+            lab_l = self._enhance_details_fast(lab_l)
             
-            return img_detail
+            result = cv2.cvtColor(cv2.merge((lab_l, lab_a, lab_b)), cv2.COLOR_LAB2BGR)
+            return result.get() if isinstance(result, cv2.UMat) else result
             
         except Exception as e:
             logger.warning(f"AI enhancement failed, using fallback: {e}")
             # Fallback to simple sharpening
             return self._apply_enhanced_sharpening(img)
     
+    def _apply_ai_enhancement_cuda(self, img: np.ndarray,
+                                   target_size: Tuple[int, int]) -> Optional[np.ndarray]:
+        """
+        Resize and AI-enhance on the GPU with a single upload and download.
+        Returns None if the GPU pipeline fails so the caller can fall back to the CPU.
+        """
+        logger.info("Applying AI-powered enhancement on the GPU...")
+        
+        try:
+            gpu_img = cv2.cuda_GpuMat()
+            gpu_img.upload(img)
+            
+            # CUDA resize has no Lanczos kernel; cubic is the closest
+            gpu_img = cv2.cuda.resize(gpu_img, target_size, interpolation=cv2.INTER_CUBIC)
+            
+            # Same steps as apply_ai_enhancement, on the LAB luminance channel
+            lab_l, lab_a, lab_b = cv2.cuda.split(cv2.cuda.cvtColor(gpu_img, cv2.COLOR_BGR2LAB))
+            lab_l = cv2.cuda.bilateralFilter(lab_l, 9, 75, 75)
+            gaussian = self._cuda_gaussian.apply(lab_l)
+            lab_l = cv2.cuda.addWeighted(lab_l, 1.5, gaussian, -0.5, 0)
+            lab_l = self._cuda_clahe.apply(lab_l, cv2.cuda.Stream_Null())
+            enhanced = self._cuda_sharpen.apply(lab_l)
+            lab_l = cv2.cuda.addWeighted(lab_l, 0.7, enhanced, 0.3, 0)
+            
+            lab = cv2.cuda.merge([lab_l, lab_a, lab_b])
+            return cv2.cuda.cvtColor(lab, cv2.COLOR_LAB2BGR).download()
+            
+        except cv2.error as e:
+            logger.warning(f"GPU enhancement failed, using CPU: {e}")
+            return None
+    
+    def _denoise_bilateral(self, img, scale_factor: float, size: Tuple[int, int]):
+        """Bilateral denoise, run at half resolution on images upscaled 2x or more"""
+        width, height = size
+        if scale_factor < 2.0:
+            # A 9px kernel is overkill on small images
+            diameter = 5 if min(width, height) < 512 else 9
+            return cv2.bilateralFilter(img, diameter, 75, 75)
+        
+        # An image upscaled >= 2x carries no extra detail at full resolution, so
+        # filtering a half-size copy (with a half-size kernel) is visually
+        # equivalent at roughly a quarter of the cost
+        small = cv2.resize(img, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+        small = cv2.bilateralFilter(small, 5, 75, 75)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    
     def _enhance_details_fast(self, img: np.ndarray) -> np.ndarray:
-        """Fast detail enhancement using OpenCV"""
+        """Fast detail enhancement using OpenCV (works on any channel count)"""
         try:
-            # Convert to grayscale for processing
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
-            # Apply Laplacian for edge detection
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            laplacian = np.uint8(np.absolute(laplacian))
-            
-            # Create enhancement mask
-            kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-            enhanced = cv2.filter2D(img, -1, kernel)
+            # Create enhancement mask. This equals 10*img - box3x3_sum(img), but
+            # filter2D's 3x3 path is faster than box filter + saturating blend,
+            # and a hand-written Numba stencil only matches it
+            enhanced = cv2.filter2D(img, -1, self.SHARPEN_KERNEL)
             
-            # Blend original with enhanced version
-            result = cv2.addWeighted(img, 0.7, enhanced, 0.3, 0)
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            # Blend original with enhanced version, reusing the enhanced buffer
+            # (addWeighted already saturates to uint8)
+            return cv2.addWeighted(img, 0.7, enhanced, 0.3, 0, dst=enhanced)
             
         except Exception as e:
             logger.warning(f"Detail enhancement failed: {e}")
             return img
     
-    def _enhance_details(self, img: np.ndarray) -> np.ndarray:
-        """Enhance fine details using morphological operations"""
-        enhanced = img.copy()
-        
-        # Apply detail enhancement to each channel
-        for i in range(img.shape[2]):
-            channel = img[:, :, i]
-            
-            # Top-hat transform to enhance bright details
-            kernel = disk(2)
-            tophat = cv2.morphologyEx(channel, cv2.MORPH_TOPHAT, kernel)
-            
-            # Black-hat transform to enhance dark details
-            blackhat = cv2.morphologyEx(channel, cv2.MORPH_BLACKHAT, kernel)
-            
-            # Combine original with enhanced details
-            enhanced[:, :, i] = np.clip(channel + 0.5 * tophat - 0.3 * blackhat, 0, 1)
-        
-        return enhanced
-    
     def apply_super_resolution(self, img: np.ndarray, scale_factor: float) -> np.ndarray:
         """
         Apply super-resolution techniques inspired by ESRGAN (optimized version)
@@ -129,12 +187,15 @@ class ImageUpscaler:
         logger.info("Applying super-resolution enhancement...")
         
         try:
-            # Step 1: Initial upscaling with Lanczos
+            # Step 1: Initial upscaling with cubic interpolation
             height, width = img.shape[:2]
             new_height, new_width = int(height * scale_factor), int(width * scale_factor)
             
-            # Use Lanczos for initial upscaling
-            upscaled = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+            # Cubic has a vectorised uint8 path that Lanczos lacks; the edge and
+            # texture stages below restore the sharpness difference
+            logger.info("Initial upscale using cubic interpolation")
+            src = cv2.UMat(img) if self._use_opencl else img
+            upscaled = cv2.resize(src, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
             
             # Step 2: Apply bilateral filter for edge-preserving smoothing
             upscaled = cv2.bilateralFilter(upscaled, 9, 75, 75)
@@ -145,14 +206,14 @@ class ImageUpscaler:
             # Step 4: Texture synthesis (simplified)
             upscaled = self._synthesize_texture_fast(upscaled, img, scale_factor)
             
-            return upscaled
+            return upscaled.get() if isinstance(upscaled, cv2.UMat) else upscaled
             
         except Exception as e:
             logger.warning(f"Super resolution failed, using fallback: {e}")
-            # Fallback to Lanczos with sharpening
+            # Fallback to cubic with sharpening
             height, width = img.shape[:2]
             new_height, new_width = int(height * scale_factor), int(width * scale_factor)
-            upscaled = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+            upscaled = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
             return self._apply_enhanced_sharpening(upscaled)
     
     def _enhance_edges_fast(self, img: np.ndarray) -> np.ndarray:
@@ -162,89 +223,46 @@ class ImageUpscaler:
             gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
             
             # Apply Laplacian filter
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            
-            # Create edge mask
-            edge_mask = np.abs(laplacian)
-            edge_mask = np.clip(edge_mask / edge_mask.max(), 0, 1)
+            laplacian = cv2.Laplacian(gray, cv2.CV_16S)
             
-            # Apply edge enhancement to each channel
-            enhanced = img.copy().astype(np.float32)
-            for i in range(3):
-                enhanced[:, :, i] = img[:, :, i].astype(np.float32) + 0.2 * edge_mask * 255
+            # Create edge mask, scaled straight to the uint8 offset to add:
+            # strength * 255 * |laplacian| / max|laplacian|
+            lap_min, lap_max, _, _ = cv2.minMaxLoc(laplacian)
+            edge_scale = (0.2 * 255.0) / max(-lap_min, lap_max, 1.0)
+            edge_mask = cv2.convertScaleAbs(laplacian, alpha=edge_scale)
             
-            return np.clip(enhanced, 0, 255).astype(np.uint8)
+            # Apply edge enhancement to all channels with a saturating uint8 add
+            return cv2.add(img, cv2.cvtColor(edge_mask, cv2.COLOR_GRAY2BGR))
             
         except Exception as e:
             logger.warning(f"Edge enhancement failed: {e}")
             return img
     
-    def _synthesize_texture_fast(self, upscaled: np.ndarray, original: np.ndarray, scale_factor: float) -> np.ndarray:
+    def _synthesize_texture_fast(self, upscaled, original: np.ndarray, scale_factor: float):
         """Fast texture synthesis using OpenCV"""
         try:
+            # upscaled may be a UMat (no shape), so size it from the original
+            height, width = original.shape[:2]
+            target_size = (int(width * scale_factor), int(height * scale_factor))
+            
             # Extract high-frequency components from original
             original_gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
             
             # Apply high-pass filter
-            kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
-            high_freq = cv2.filter2D(original_gray, -1, kernel)
+            high_freq = cv2.filter2D(original_gray, -1, self.HIGH_PASS_KERNEL)
             
             # Upscale high-frequency components
-            high_freq_upscaled = cv2.resize(high_freq, 
-                                          (upscaled.shape[1], upscaled.shape[0]), 
+            high_freq_upscaled = cv2.resize(high_freq, target_size,
                                           interpolation=cv2.INTER_CUBIC)
             
-            # Add high-frequency details to upscaled image
-            result = upscaled.copy().astype(np.float32)
-            for i in range(3):
-                result[:, :, i] += 0.05 * high_freq_upscaled
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            # Add high-frequency details to all channels with a saturating uint8 add
+            detail = cv2.convertScaleAbs(high_freq_upscaled, alpha=0.05)
+            return cv2.add(upscaled, cv2.cvtColor(detail, cv2.COLOR_GRAY2BGR))
             
         except Exception as e:
             logger.warning(f"Texture synthesis failed: {e}")
             return upscaled
     
-    def _enhance_edges(self, img: np.ndarray) -> np.ndarray:
-        """Enhance edges using Laplacian sharpening"""
-        # Convert to grayscale for edge detection
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply Laplacian filter
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        
-        # Create edge mask
-        edge_mask = np.abs(laplacian)
-        edge_mask = np.clip(edge_mask / edge_mask.max(), 0, 1)
-        
-        # Apply edge enhancement to each channel
-        enhanced = img.copy().astype(np.float32)
-        for i in range(3):
-            enhanced[:, :, i] = img[:, :, i].astype(np.float32) + 0.3 * edge_mask * 255
-        
-        return np.clip(enhanced, 0, 255).astype(np.uint8)
-    
-    def _synthesize_texture(self, upscaled: np.ndarray, original: np.ndarray, scale_factor: float) -> np.ndarray:
-        """Synthesize high-frequency details"""
-        # Extract high-frequency components from original
-        original_gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
-        
-        # Apply high-pass filter
-        kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
-        high_freq = cv2.filter2D(original_gray, -1, kernel)
-        
-        # Upscale high-frequency components
-        high_freq_upscaled = cv2.resize(high_freq, 
-                                      (upscaled.shape[1], upscaled.shape[0]), 
-                                      interpolation=cv2.INTER_CUBIC)
-        
-        # Add high-frequency details to upscaled image
-        result = upscaled.copy().astype(np.float32)
-        for i in range(3):
-            result[:, :, i] += 0.1 * high_freq_upscaled
-        
-        return np.clip(result, 0, 255).astype(np.uint8)
-    
     def _apply_enhanced_sharpening(self, img: np.ndarray) -> np.ndarray:
         """Apply enhanced sharpening with multiple techniques"""
         # Method 1: Unsharp masking
@@ -252,17 +270,15 @@ class ImageUpscaler:
         unsharp_mask = cv2.addWeighted(img, 1.5, gaussian, -0.5, 0)
         
         # Method 2: Laplacian sharpening
-        laplacian = cv2.Laplacian(img, cv2.CV_64F)
-        laplacian_sharpened = img.astype(np.float64) + 0.3 * laplacian
+        laplacian = cv2.Laplacian(img, cv2.CV_16S)
+        laplacian_sharpened = cv2.addWeighted(img, 1.0, laplacian, 0.3, 0, dtype=cv2.CV_8U)
         
         # Method 3: Edge-preserving filter
         edge_preserved = cv2.edgePreservingFilter(img, flags=1, sigma_s=50, sigma_r=0.4)
         
         # Combine all methods
-        result = cv2.addWeighted(unsharp_mask, 0.4, laplacian_sharpened.astype(np.uint8), 0.3, 0)
-        result = cv2.addWeighted(result, 0.7, edge_preserved, 0.3, 0)
-        
-        return np.clip(result, 0, 255).astype(np.uint8)
+        result = cv2.addWeighted(unsharp_mask, 0.4, laplacian_sharpened, 0.3, 0, dst=unsharp_mask)
+        return cv2.addWeighted(result, 0.7, edge_preserved, 0.3, 0, dst=result)
     
     def calculate_target_size(self, original_size: Tuple[int, int], 
                             scale_factor: Optional[float] = None,
@@ -315,61 +331,20 @@ class ImageUpscaler:
         try:
             start_time = time.time()
             
-            # Load image
             logger.info(f"Loading image: {input_path}")
-            img = cv2.imread(input_path)
+            img, original_size = self._decode(lambda flag: cv2.imread(input_path, flag),
+                                              input_path, scale_factor)
             
             if img is None:
                 logger.error("Failed to load image")
                 return False
             
-            original_size = img.shape[1], img.shape[0]  # width, height
-            logger.info(f"Original size: {original_size[0]}x{original_size[1]}")
-            
-            # Calculate target size
-            target_size = self.calculate_target_size(
-                original_size, scale_factor, target_width, target_height
-            )
-            
-            logger.info(f"Target size: {target_size[0]}x{target_size[1]}")
-            
-            # Calculate scale factor for AI methods
-            actual_scale_factor = target_size[0] / original_size[0]
-            
-            # Choose interpolation method and apply AI enhancement
-            if interpolation == 'ai_enhanced':
-                logger.info("Using AI-enhanced upscaling...")
-                # First upscale with Lanczos
-                upscaled_img = cv2.resize(img, target_size, interpolation=cv2.INTER_LANCZOS4)
-                # Then apply AI enhancement
-                upscaled_img = self.apply_ai_enhancement(upscaled_img, actual_scale_factor)
-                
-            elif interpolation == 'super_resolution':
-                logger.info("Using super-resolution upscaling...")
-                upscaled_img = self.apply_super_resolution(img, actual_scale_factor)
-                
-            else:
-                # Traditional interpolation methods
-                interp_method = self.interpolation_methods[interpolation]
-                logger.info(f"Upscaling using {interpolation} interpolation...")
-                upscaled_img = cv2.resize(img, target_size, interpolation=interp_method)
-                
-                # Apply enhanced sharpening for better quality
-                if interpolation in ['cubic', 'lanczos']:
-                    upscaled_img = self._apply_enhanced_sharpening(upscaled_img)
+            upscaled_img = self._upscale_array(img, original_size, scale_factor,
+                                               target_width, target_height, interpolation)
             
             # Save output
             logger.info(f"Saving upscaled image: {output_path}")
-            
-            # Determine compression parameters based on file extension
-            output_ext = Path(output_path).suffix.lower()
-            if output_ext in ['.jpg', '.jpeg']:
-                encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-            elif output_ext == '.png':
-                encode_params = [cv2.IMWRITE_PNG_COMPRESSION, 9 - (quality // 10)]
-            else:
-                encode_params = []
-            
+            encode_params = self._encode_params(Path(output_path).suffix, quality)
             success = cv2.imwrite(output_path, upscaled_img, encode_params)
             
             if success:
@@ -385,14 +360,170 @@ class ImageUpscaler:
             logger.error(f"Error during upscaling: {e}")
             return False
     
+    def upscale_bytes(self, data: bytes, output_ext: str,
+                      scale_factor: Optional[float] = None,
+                      target_width: Optional[int] = None,
+                      target_height: Optional[int] = None,
+                      interpolation: str = 'ai_enhanced',
+                      quality: int = 95) -> Optional[bytes]:
+        """
+        Upscale an encoded image held in memory, without touching the disk
+        
+        Args:
+            data: Encoded input image
+            output_ext: Output format as a file extension (e.g. 'png')
+            Remaining arguments as for upscale_image
+        
+        Returns:
+            The encoded output image, or None on failure
+        """
+        if interpolation not in self.interpolation_methods:
+            logger.error(f"Invalid interpolation method: {interpolation}")
+            return None
+        
+        try:
+            start_time = time.time()
+            
+            buf = np.frombuffer(data, dtype=np.uint8)
+            img, original_size = self._decode(lambda flag: cv2.imdecode(buf, flag),
+                                              io.BytesIO(data), scale_factor)
+            
+            if img is None:
+                logger.error("Failed to decode image")
+                return None
+            
+            upscaled_img = self._upscale_array(img, original_size, scale_factor,
+                                               target_width, target_height, interpolation)
+            
+            ext = '.' + output_ext.lstrip('.').lower()
+            success, encoded = cv2.imencode(ext, upscaled_img, self._encode_params(ext, quality))
+            
+            if success:
+                logger.info(f"Upscaling completed in {time.time() - start_time:.2f} seconds")
+                return encoded.tobytes()
+            else:
+                logger.error("Failed to encode output image")
+                return None
+                
+        except Exception as e:
+            logger.error(f"Error during upscaling: {e}")
+            return None
+    
+    @staticmethod
+    def _decode(decode, header_source, scale_factor: Optional[float]) -> tuple:
+        """
+        Decode an image with decode(flag) and return it with its full
+        (width, height). For downscales of 2x or more, let the decoder drop
+        resolution up front (JPEG does this straight from the DCT data). The
+        reduced decode rounds odd sizes up, so the full size is read from the
+        header of header_source (a path or file object) instead
+        """
+        if scale_factor is not None and scale_factor <= 0.5:
+            try:
+                with Image.open(header_source) as header:
+                    width, height = header.size
+            except Exception as e:
+                logger.debug(f"Could not read image header: {e}")
+            else:
+                img = decode(cv2.IMREAD_REDUCED_COLOR_2)
+                if img is None:
+                    return None, None
+                reduced = ((width + 1) // 2, (height + 1) // 2)
+                if reduced == (img.shape[1], img.shape[0]):
+                    logger.info("Decoded at 1/2 resolution for downscale")
+                    return img, (width, height)
+                if reduced == (img.shape[0], img.shape[1]):
+                    # The decoder applied an EXIF rotation
+                    logger.info("Decoded at 1/2 resolution for downscale")
+                    return img, (height, width)
+                logger.debug("Reduced decode does not match the header, decoding at full size")
+        
+        img = decode(cv2.IMREAD_COLOR)
+        if img is None:
+            return None, None
+        return img, (img.shape[1], img.shape[0])
+    
+    @staticmethod
+    def _encode_params(ext: str, quality: int) -> list:
+        """Determine compression parameters based on file extension"""
+        ext = ext.lower()
+        if ext in ['.jpg', '.jpeg']:
+            return [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif ext == '.png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, 9 - (quality // 10)]
+        return []
+    
+    def _upscale_array(self, img: np.ndarray,
+                       original_size: Tuple[int, int],
+                       scale_factor: Optional[float],
+                       target_width: Optional[int],
+                       target_height: Optional[int],
+                       interpolation: str) -> np.ndarray:
+        """
+        Resize and enhance a decoded image with the chosen method. The target
+        size is computed from original_size, the image's full (width, height),
+        which is larger than img when it was decoded at reduced resolution
+        """
+        logger.info(f"Original size: {original_size[0]}x{original_size[1]}")
+        
+        # Calculate target size
+        target_size = self.calculate_target_size(
+            original_size, scale_factor, target_width, target_height
+        )
+        
+        logger.info(f"Target size: {target_size[0]}x{target_size[1]}")
+        
+        # Scale factor from the decoded pixels, for AI methods
+        decoded_size = img.shape[1], img.shape[0]  # width, height
+        actual_scale_factor = target_size[0] / decoded_size[0]
+        
+        # Choose interpolation method and apply AI enhancement
+        is_enlarging = target_size[0] > decoded_size[0] or target_size[1] > decoded_size[1]
+        if interpolation in ('ai_enhanced', 'super_resolution') and not is_enlarging:
+            # Nothing to reconstruct when the image is not enlarged, so skip
+            # the denoise/CLAHE/texture stages and only sharpen
+            logger.info("Target is not larger than original, applying sharpening only...")
+            if target_size != decoded_size:
+                img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+            return self._apply_enhanced_sharpening(img)
+        
+        if interpolation == 'ai_enhanced':
+            logger.info("Using AI-enhanced upscaling...")
+            if self._use_cuda and min(target_size) >= 256:
+                upscaled_img = self._apply_ai_enhancement_cuda(img, target_size)
+                if upscaled_img is not None:
+                    return upscaled_img
+            
+            # First upscale with cubic: several times faster than Lanczos,
+            # and the enhancement's unsharp mask recovers the sharpness
+            logger.info("Initial upscale using cubic interpolation")
+            upscaled_img = cv2.resize(img, target_size, interpolation=cv2.INTER_CUBIC)
+            # Then apply AI enhancement
+            return self.apply_ai_enhancement(upscaled_img, actual_scale_factor)
+        
+        if interpolation == 'super_resolution':
+            logger.info("Using super-resolution upscaling...")
+            return self.apply_super_resolution(img, actual_scale_factor)
+        
+        # Traditional interpolation methods
+        interp_method = self.interpolation_methods[interpolation]
+        logger.info(f"Upscaling using {interpolation} interpolation...")
+        upscaled_img = cv2.resize(img, target_size, interpolation=interp_method)
+        
+        # Apply enhanced sharpening for better quality
+        if interpolation in ['cubic', 'lanczos']:
+            upscaled_img = self._apply_enhanced_sharpening(upscaled_img)
+        return upscaled_img
+    
     def batch_upscale(self, input_dir: str, output_dir: str,
                     scale_factor: Optional[float] = None,
                     target_width: Optional[int] = None,
                     target_height: Optional[int] = None,
                     interpolation: str = 'lanczos',
-                    quality: int = 95) -> int:
+                    quality: int = 95,
+                    max_workers: Optional[int] = None) -> int:
         """
-        Batch upscale all images in a directory
+        Batch upscale all images in a directory using a process pool
         """
         input_path = Path(input_dir)
         output_path = Path(output_dir)
@@ -417,20 +548,46 @@ class ImageUpscaler:
         
         logger.info(f"Found {len(image_files)} images to process")
         
-        successful = 0
-        for i, img_file in enumerate(image_files, 1):
-            logger.info(f"Processing {i}/{len(image_files)}: {img_file.name}")
-            
-            output_file = output_path / f"upscaled_{img_file.name}"
-            
-            if self.upscale_image(str(img_file), str(output_file),
-                                scale_factor, target_width, target_height,
-                                interpolation, quality):
-                successful += 1
+        jobs = [
+            (str(img_file), str(output_path / f"upscaled_{img_file.name}"),
+             scale_factor, target_width, target_height, interpolation, quality)
+            for img_file in image_files
+        ]
+        
+        # Images are independent, so fan them out across processes. Workers
+        # are spawned rather than forked: this process may already hold
+        # OpenCL/CUDA contexts, which do not survive a fork
+        max_workers = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(jobs) // (max_workers * 4))
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_batch_worker) as executor:
+            results = list(executor.map(_upscale_one, jobs, chunksize=chunksize))
         
+        successful = sum(results)
         logger.info(f"Batch processing completed: {successful}/{len(image_files)} images processed successfully")
         return successful
 
+# Upscaler of a batch worker process, built once by _init_batch_worker
+_batch_upscaler = None
+
+def _init_batch_worker():
+    """
+    Limit OpenCV to one thread per batch worker to avoid oversubscription,
+    and build the worker's upscaler for all of its jobs
+    """
+    global _batch_upscaler
+    cv2.setNumThreads(1)
+    _batch_upscaler = ImageUpscaler()
+
+def _upscale_one(job: tuple) -> bool:
+    """Upscale a single batch job (module-level so it can be pickled)"""
+    input_file, output_file, scale_factor, target_width, target_height, interpolation, quality = job
+    logger.info(f"Processing {Path(input_file).name}")
+    return _batch_upscaler.upscale_image(input_file, output_file,
+                                         scale_factor, target_width, target_height,
+                                         interpolation, quality)
+
 def main():
     """Command line interface"""
     parser = argparse.ArgumentParser(description='Advanced Image Upscaler')
@@ -1,4 +1,5 @@
 from http.server import BaseHTTPRequestHandler
+import io
 import json
 import os
 import uuid
@@ -6,6 +7,13 @@ import base64
 import cv2
 import numpy as np
 import logging
+from PIL import Image
+
+try:
+    from streaming_form_data import StreamingFormDataParser
+    from streaming_form_data.targets import ValueTarget
+except ImportError:
+    StreamingFormDataParser = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +22,8 @@ logger = logging.getLogger(__name__)
 class ImageUpscaler:
     """Simplified Image Upscaler for Vercel deployment"""
     
+    SHARPEN_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], dtype=np.float32)
+    
     def __init__(self):
         self.interpolation_methods = {
             'cubic': cv2.INTER_CUBIC,
@@ -24,50 +34,42 @@ class ImageUpscaler:
             'ai_enhanced': 'ai_enhanced',
             'super_resolution': 'super_resolution'
         }
+        self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
     
     def apply_ai_enhancement(self, img: np.ndarray, scale_factor: float) -> np.ndarray:
         """Apply AI-powered enhancement techniques"""
         try:
+            # Work in LAB throughout so every filter runs on the L channel only
+            lab_l, lab_a, lab_b = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2LAB))
+            
             # Step 1: Noise reduction using bilateral filter
-            img_denoised = cv2.bilateralFilter(img, 9, 75, 75)
+            lab_l = cv2.bilateralFilter(lab_l, 9, 75, 75)
             
             # Step 2: Edge enhancement using unsharp masking
-            gaussian = cv2.GaussianBlur(img_denoised, (0, 0), 2.0)
-            img_enhanced = cv2.addWeighted(img_denoised, 1.5, gaussian, -0.5, 0)
+            gaussian = cv2.GaussianBlur(lab_l, (0, 0), 2.0)
+            lab_l = cv2.addWeighted(lab_l, 1.5, gaussian, -0.5, 0)
             
             # Step 3: Contrast enhancement using CLAHE
-            lab = cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2LAB)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            lab[:,:,0] = clahe.apply(lab[:,:,0])
-            img_contrast = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+            lab_l = self._clahe.apply(lab_l)
             
             # Step 4: Detail enhancement
-            img_detail = self._enhance_details_fast(img_contrast)
+            lab_l = self._enhance_details_fast(lab_l)
             
-            return img_detail
+            return cv2.cvtColor(cv2.merge((lab_l, lab_a, lab_b)), cv2.COLOR_LAB2BGR)
             
         except Exception as e:
             logger.warning(f"AI enhancement failed, using fallback: {e}")
             return self._apply_enhanced_sharpening(img)
     
     def _enhance_details_fast(self, img: np.ndarray) -> np.ndarray:
-        """Fast detail enhancement using OpenCV"""
+        """Fast detail enhancement using OpenCV (works on any channel count)"""
         try:
-            # Convert to grayscale for processing
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
-            # Apply Laplacian for edge detection
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            laplacian = np.uint8(np.absolute(laplacian))
-            
             # Create enhancement mask
-            kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-            enhanced = cv2.filter2D(img, -1, kernel)
+            enhanced = cv2.filter2D(img, -1, self.SHARPEN_KERNEL)
             
-            # Blend original with enhanced version
-            result = cv2.addWeighted(img, 0.7, enhanced, 0.3, 0)
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            # Blend original with enhanced version, reusing the enhanced buffer
+            # (addWeighted already saturates to uint8)
+            return cv2.addWeighted(img, 0.7, enhanced, 0.3, 0, dst=enhanced)
             
         except Exception as e:
             logger.warning(f"Detail enhancement failed: {e}")
@@ -81,79 +83,148 @@ class ImageUpscaler:
             unsharp_mask = cv2.addWeighted(img, 1.5, gaussian, -0.5, 0)
             
             # Method 2: Laplacian sharpening
-            laplacian = cv2.Laplacian(img, cv2.CV_64F)
-            laplacian_sharpened = img.astype(np.float64) + 0.3 * laplacian
+            laplacian = cv2.Laplacian(img, cv2.CV_16S)
+            laplacian_sharpened = cv2.addWeighted(img, 1.0, laplacian, 0.3, 0, dtype=cv2.CV_8U)
             
             # Combine methods
-            result = cv2.addWeighted(unsharp_mask, 0.7, laplacian_sharpened.astype(np.uint8), 0.3, 0)
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            return cv2.addWeighted(unsharp_mask, 0.7, laplacian_sharpened, 0.3, 0, dst=unsharp_mask)
             
         except Exception as e:
             logger.warning(f"Sharpening failed: {e}")
             return img
 
 class handler(BaseHTTPRequestHandler):
+    FORM_FIELDS = ('file', 'scale_factor', 'interpolation', 'quality')
+    READ_CHUNK_SIZE = 64 * 1024
+    WEBP_MAX_DIMENSION = 16383
+    
     def do_POST(self):
         if self.path == '/api/upload':
             self.handle_upload()
         else:
             self.send_error(404, "Not Found")
     
+    @staticmethod
+    def _iter_multipart(body: bytes, boundary: bytes):
+        """Yield (headers, value) per multipart part as zero-copy memoryview slices"""
+        view = memoryview(body)
+        delimiter = b'--' + boundary
+        pos = body.find(delimiter)
+        while pos != -1:
+            start = pos + len(delimiter)
+            if body.startswith(b'--', start):
+                break  # Closing delimiter
+            next_pos = body.find(b'\r\n' + delimiter, start)
+            if next_pos == -1:
+                break
+            header_end = body.find(b'\r\n\r\n', start, next_pos)
+            if header_end != -1:
+                yield bytes(view[start:header_end]), view[header_end + 4:next_pos]
+            pos = next_pos + 2
+    
+    def _read_form(self, content_length: int) -> dict:
+        """Read the multipart request body into {field name: value bytes}"""
+        if StreamingFormDataParser is None:
+            # Fall back to buffering the body and scanning it for boundaries
+            boundary = self.headers['Content-Type'].split('boundary=')[1].strip('"')
+            body = self.rfile.read(content_length)
+            fields = {}
+            for part_headers, value in self._iter_multipart(body, boundary.encode()):
+                if b'Content-Disposition: form-data' not in part_headers:
+                    continue
+                for name in self.FORM_FIELDS:
+                    if f'name="{name}"'.encode() in part_headers:
+                        fields[name] = value
+                        break
+            return fields
+        
+        # Feed the body to the parser as it arrives so no full copy is held
+        parser = StreamingFormDataParser(headers={'Content-Type': self.headers['Content-Type']})
+        targets = {name: ValueTarget() for name in self.FORM_FIELDS}
+        for name, target in targets.items():
+            parser.register(name, target)
+        
+        remaining = content_length
+        while remaining > 0:
+            chunk = self.rfile.read(min(self.READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            parser.data_received(chunk)
+            remaining -= len(chunk)
+        
+        return {name: target.value for name, target in targets.items() if target.value}
+    
+    @staticmethod
+    def _full_size(data, img, reduction):
+        """
+        Full (width, height) of an image decoded at 1/reduction resolution.
+        The reduced decode rounds odd sizes up, so it is read from the header;
+        None if the header cannot be read or does not match the decoded image
+        """
+        try:
+            with Image.open(io.BytesIO(data)) as header:
+                width, height = header.size
+        except Exception as e:
+            logger.debug(f"Could not read image header: {e}")
+            return None
+        reduced = ((width + reduction - 1) // reduction, (height + reduction - 1) // reduction)
+        if reduced == (img.shape[1], img.shape[0]):
+            return width, height
+        if reduced == (img.shape[0], img.shape[1]):
+            # The decoder applied an EXIF rotation
+            return height, width
+        return None
+    
     def handle_upload(self):
         try:
-            # Parse request
+            # Parse multipart form data
             content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            fields = self._read_form(content_length)
             
-            # Parse multipart form data
-            boundary = self.headers['Content-Type'].split('boundary=')[1]
-            parts = post_data.split(f'--{boundary}'.encode())
-            
-            file_data = None
-            scale_factor = 2.0
-            interpolation = 'ai_enhanced'
-            quality = 95
-            
-            for part in parts:
-                if b'Content-Disposition: form-data' in part:
-                    if b'name="file"' in part:
-                        # Extract file data
-                        file_start = part.find(b'\r\n\r\n') + 4
-                        file_data = part[file_start:-2]  # Remove trailing \r\n
-                    elif b'name="scale_factor"' in part:
-                        value_start = part.find(b'\r\n\r\n') + 4
-                        scale_factor = float(part[value_start:-2])
-                    elif b'name="interpolation"' in part:
-                        value_start = part.find(b'\r\n\r\n') + 4
-                        interpolation = part[value_start:-2].decode()
-                    elif b'name="quality"' in part:
-                        value_start = part.find(b'\r\n\r\n') + 4
-                        quality = int(part[value_start:-2])
+            file_data = fields.get('file')
+            scale_factor = float(bytes(fields['scale_factor'])) if 'scale_factor' in fields else 2.0
+            interpolation = bytes(fields['interpolation']).decode() if 'interpolation' in fields else 'ai_enhanced'
+            quality = int(bytes(fields['quality'])) if 'quality' in fields else 95
             
             if not file_data:
                 self.send_error(400, "No file provided")
                 return
             
-            # Decode image from bytes
+            # Decode image from bytes. For downscales of 2x or more, let the
+            # decoder drop resolution up front (JPEG does this from the DCT data)
+            reduction, read_flag = 1, cv2.IMREAD_COLOR
+            if scale_factor <= 0.25:
+                reduction, read_flag = 4, cv2.IMREAD_REDUCED_COLOR_4
+            elif scale_factor <= 0.5:
+                reduction, read_flag = 2, cv2.IMREAD_REDUCED_COLOR_2
             nparr = np.frombuffer(file_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            img = cv2.imdecode(nparr, read_flag)
             
             if img is None:
                 self.send_error(400, "Invalid image file")
                 return
             
+            height, width = img.shape[:2]
+            if reduction > 1:
+                size = self._full_size(file_data, img, reduction)
+                if size is None:
+                    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                    size = img.shape[1], img.shape[0]
+                width, height = size
+            
             # Initialize upscaler
             upscaler = ImageUpscaler()
             
-            # Calculate target size
-            height, width = img.shape[:2]
+            # Calculate target size from the full-resolution size
+            original_size = f"{width}x{height}"
             new_height, new_width = int(height * scale_factor), int(width * scale_factor)
             
             # Upscale image
             if interpolation == 'ai_enhanced':
-                # First upscale with Lanczos
-                upscaled_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+                # First upscale with cubic (much faster than Lanczos; the
+                # enhancement's unsharp mask recovers the sharpness)
+                logger.info("Initial upscale using cubic interpolation")
+                upscaled_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
                 # Then apply AI enhancement
                 upscaled_img = upscaler.apply_ai_enhancement(upscaled_img, scale_factor)
             else:
@@ -163,30 +234,45 @@ class handler(BaseHTTPRequestHandler):
                 if interpolation in ['cubic', 'lanczos']:
                     upscaled_img = upscaler._apply_enhanced_sharpening(upscaled_img)
             
-            # Encode result as PNG
-            success, encoded_img = cv2.imencode('.png', upscaled_img)
+            # Encode result as WebP: smaller and faster to encode than PNG.
+            # WebP cannot hold images larger than WEBP_MAX_DIMENSION on a side,
+            # so those (or a failed WebP encode) fall back to PNG
+            success = False
+            if max(upscaled_img.shape[:2]) <= self.WEBP_MAX_DIMENSION:
+                output_mime = 'image/webp'
+                success, encoded_img = cv2.imencode('.webp', upscaled_img,
+                                                    [cv2.IMWRITE_WEBP_QUALITY, quality])
+            if not success:
+                output_mime = 'image/png'
+                success, encoded_img = cv2.imencode('.png', upscaled_img)
             
             if success:
                 # Convert to base64
-                output_base64 = base64.b64encode(encoded_img).decode()
+                output_base64 = base64.b64encode(encoded_img)
                 
-                # Send response
+                # Send response. The base64 payload is written straight after a
+                # JSON prefix instead of being copied into a Python str first
                 response = {
                     'success': True,
                     'file_id': str(uuid.uuid4()),
-                    'output_data': output_base64,
+                    'output_mime': output_mime,
                     'file_size': len(encoded_img),
-                    'original_size': f"{width}x{height}",
+                    'original_size': original_size,
                     'upscaled_size': f"{new_width}x{new_height}"
                 }
+                body_prefix = (json.dumps(response)[:-1] + ', "output_data": "').encode()
+                body_suffix = b'"}'
                 
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body_prefix) + len(output_base64) + len(body_suffix)))
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
                 self.send_header('Access-Control-Allow-Headers', 'Content-Type')
                 self.end_headers()
-                self.wfile.write(json.dumps(response).encode())
+                self.wfile.write(body_prefix)
+                self.wfile.write(output_base64)
+                self.wfile.write(body_suffix)
                 
             else:
                 self.send_error(500, "Failed to encode upscaled image")
@@ -1,17 +1,45 @@
-from flask import Flask, request, jsonify, render_template, send_file, g
+from flask import Flask, Response, request, jsonify, render_template, send_file, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_caching import Cache
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
+import hashlib
+import shutil
+import tempfile
+import mimetypes
 import uuid
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from ImageUpscalePython import ImageUpscaler
 from config import get_config
 from utils.logging import logger, log_request_duration, handle_exceptions, error_handler
 from utils.security import security_validator, rate_limiter
 
+try:
+    from apscheduler.schedulers.background import BackgroundScheduler
+except ImportError:
+    BackgroundScheduler = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    from tasks import upscale_task
+except ImportError:
+    upscale_task = None
+
+try:
+    from streaming_form_data import StreamingFormDataParser
+    from streaming_form_data.targets import FileTarget, ValueTarget
+except ImportError:
+    StreamingFormDataParser = None
+
 # Initialize Flask app with configuration
 config_class = get_config()
 app = Flask(__name__)
@@ -27,6 +55,7 @@ limiter = Limiter(
 
 cache = Cache(app, config={
     'CACHE_TYPE': app.config['CACHE_TYPE'],
+    'CACHE_REDIS_URL': app.config['CACHE_REDIS_URL'],
     'CACHE_DEFAULT_TIMEOUT': app.config['CACHE_DEFAULT_TIMEOUT']
 })
 
@@ -34,72 +63,207 @@ cache = Cache(app, config={
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-# File cleanup thread
-cleanup_thread = None
+# Shared upscaler, built once per process. Its cached CLAHE and CUDA filter
+# objects keep internal buffers, so calls are serialised
+upscaler = ImageUpscaler()
+upscaler_lock = threading.Lock()
+
+# Bound once so the upload path skips the app.config lookups
+ALLOWED_EXTENSIONS = app.config['ALLOWED_EXTENSIONS']
+ALLOWED_EXTENSIONS_TEXT = ", ".join(sorted(ALLOWED_EXTENSIONS))
+
+# Form fields accepted alongside the uploaded file
+UPLOAD_FORM_FIELDS = ('scale_factor', 'target_width', 'target_height', 'interpolation', 'quality')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Upload checks that decode or read the whole file run here, off the request thread
+validation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='validate')
+
+# File cleanup runs on one long-lived thread
+cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cleanup')
+cleanup_future = None
 cleanup_lock = threading.Lock()
 
+def cleanup_task():
+    """Remove uploads and outputs older than FILE_MAX_AGE"""
+    try:
+        current_time = time.time()
+        max_age = app.config['FILE_MAX_AGE']
+        
+        # Clean up uploads and outputs. scandir's entries carry the file
+        # type from readdir, and stat() results are cached per entry
+        for folder, kind in ((app.config['UPLOAD_FOLDER'], 'upload'),
+                             (app.config['OUTPUT_FOLDER'], 'output')):
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and current_time - entry.stat().st_mtime > max_age:
+                        os.remove(entry.path)
+                        logger.logger.info(f"Cleaned up old {kind} file: {entry.name}")
+                    
+    except Exception as e:
+        logger.log_error(e, {'operation': 'file_cleanup'})
+
 def cleanup_old_files():
     """Clean up old files in background thread"""
-    global cleanup_thread
+    global cleanup_future
     
     with cleanup_lock:
-        if cleanup_thread and cleanup_thread.is_alive():
+        if cleanup_future and not cleanup_future.done():
             return  # Cleanup already running
         
-        def cleanup_task():
-            try:
-                current_time = time.time()
-                max_age = app.config['FILE_MAX_AGE']
-                
-                # Clean up uploads
-                for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    if os.path.isfile(file_path):
-                        file_age = current_time - os.path.getmtime(file_path)
-                        if file_age > max_age:
-                            os.remove(file_path)
-                            logger.logger.info(f"Cleaned up old upload file: {filename}")
-                
-                # Clean up outputs
-                for filename in os.listdir(app.config['OUTPUT_FOLDER']):
-                    file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-                    if os.path.isfile(file_path):
-                        file_age = current_time - os.path.getmtime(file_path)
-                        if file_age > max_age:
-                            os.remove(file_path)
-                            logger.logger.info(f"Cleaned up old output file: {filename}")
-                            
-            except Exception as e:
-                logger.log_error(e, {'operation': 'file_cleanup'})
-        
-        cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
-        cleanup_thread.start()
+        cleanup_future = cleanup_executor.submit(cleanup_task)
+
+# Started by the server entry points (__main__ below, and the gunicorn hook in
+# gunicorn.conf.py), never on import, so tests and tools that import this
+# module leave the upload and output folders alone
+cleanup_scheduler = None
+
+def start_cleanup_scheduler():
+    """
+    Run cleanup_task every FILE_CLEANUP_INTERVAL seconds in one process.
+    Every gunicorn worker calls this, so an exclusive lock file picks the
+    worker that runs it; a recycled worker frees the lock for its successor.
+    Without APScheduler a single pass runs instead.
+    """
+    global cleanup_scheduler
+    if BackgroundScheduler is None:
+        cleanup_old_files()
+        return None
+    
+    lock_file = None
+    if fcntl is not None:
+        lock_file = open(os.path.join(tempfile.gettempdir(), 'image_upscaler_cleanup.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None  # Another worker runs the cleanup
+    
+    scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(cleanup_task, 'interval', seconds=app.config['FILE_CLEANUP_INTERVAL'],
+                      next_run_time=datetime.now())
+    scheduler.start()
+    scheduler.lock_file = lock_file  # Held for the life of the process
+    cleanup_scheduler = scheduler
+    return scheduler
+
+def receive_upload(upload_path):
+    """
+    Write the uploaded 'file' part to upload_path and return (filename, form).
+    filename is None when the request has no file part.
+    """
+    if StreamingFormDataParser is None or request.mimetype != 'multipart/form-data':
+        file = request.files.get('file')
+        if file is None:
+            return None, request.form
+        file.save(upload_path, buffer_size=UPLOAD_CHUNK_SIZE)
+        return file.filename, request.form
+    
+    # Parse the body as it arrives so the file goes straight to disk
+    parser = StreamingFormDataParser(headers=request.headers)
+    file_target = FileTarget(upload_path)
+    parser.register('file', file_target)
+    fields = {name: ValueTarget() for name in UPLOAD_FORM_FIELDS}
+    for name, target in fields.items():
+        parser.register(name, target)
+    
+    while True:
+        chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.data_received(chunk)
+    
+    form = MultiDict({name: target.value.decode() for name, target in fields.items() if target.value})
+    return file_target.multipart_filename, form
+
+def discard_file(path):
+    """Remove a file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def is_valid_file_id(file_id):
+    """True if file_id is a UUID in the canonical form upload_file issues"""
+    try:
+        return str(uuid.UUID(file_id)) == file_id
+    except ValueError:
+        return False
+
+def find_file(folder, file_id, suffix):
+    """Path of '{file_id}_{suffix}.<ext>' in folder, or None if there is no such file"""
+    ext = cache.get(f'ext:{file_id}')
+    if ext is not None:
+        file_path = os.path.join(folder, f"{file_id}_{suffix}.{ext}")
+        return file_path if os.path.exists(file_path) else None
+    
+    # Extension not cached (evicted, or uploaded through another worker).
+    # scandir stops reading the directory at the first match
+    prefix = f"{file_id}_{suffix}."
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix):
+                return entry.path
+    return None
+
+def send_output_file(file_path, as_attachment=False, max_age=None):
+    """
+    Send an output file, letting nginx do the transfer when it fronts the app.
+    With max_age the response is publicly cacheable; either way it carries an
+    ETag and Last-Modified so repeat requests can be answered with 304.
+    """
+    if not app.config['USE_X_ACCEL_REDIRECT']:
+        # send_file goes through wsgi.file_wrapper, which gunicorn serves with sendfile()
+        return send_file(file_path, as_attachment=as_attachment, conditional=True,
+                         etag=True, max_age=max_age)
+    
+    # nginx adds its own ETag/Last-Modified and handles conditional requests
+    filename = os.path.basename(file_path)
+    response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_OUTPUT_PREFIX'] + filename
+    if as_attachment:
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+# The main page only resolves static URLs, so it is rendered once at startup
+with app.test_request_context('/'):
+    INDEX_HTML = render_template('index.html').encode()
+INDEX_ETAG = hashlib.blake2b(INDEX_HTML, digest_size=16).hexdigest()
 
 @app.route('/')
-@cache.cached(timeout=300)  # Cache for 5 minutes
 def index():
     """Serve the main page"""
-    return render_template('index.html')
+    response = Response(INDEX_HTML, mimetype='text/html')
+    response.set_etag(INDEX_ETAG)
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
+def is_healthy_result(rv):
+    """
+    Whether a health check result may be cached. Unhealthy results are
+    returned with a 503 and never cached, so recovery is seen at once
+    """
+    status = rv[1] if isinstance(rv, tuple) else rv.status_code
+    return status == 200
 
 @app.route('/health')
+@cache.cached(timeout=10, response_filter=is_healthy_result)  # Probes arrive every few seconds
 def health_check():
     """Health check endpoint for monitoring"""
     try:
-        # Check if directories exist and are writable
+        # Check if directories exist and are writable (permission check only,
+        # no test file is written)
         upload_dir = app.config['UPLOAD_FOLDER']
         output_dir = app.config['OUTPUT_FOLDER']
         
         if not os.path.exists(upload_dir) or not os.path.exists(output_dir):
             return jsonify({'status': 'unhealthy', 'error': 'Directories not accessible'}), 503
         
-        # Test file operations
-        test_file = os.path.join(upload_dir, f'test_{uuid.uuid4()}.txt')
-        try:
-            with open(test_file, 'w') as f:
-                f.write('test')
-            os.remove(test_file)
-        except Exception as e:
-            return jsonify({'status': 'unhealthy', 'error': f'File operations failed: {str(e)}'}), 503
+        if not os.access(upload_dir, os.W_OK) or not os.access(output_dir, os.W_OK):
+            return jsonify({'status': 'unhealthy', 'error': 'Directories not writable'}), 503
         
         return jsonify({
             'status': 'healthy',
@@ -144,6 +308,11 @@ def metrics():
 def upload_file():
     """Handle file upload and upscaling"""
     start_time = time.time()
+    upload_path = None
+    
+    # Refuse oversized bodies from the declared length, before reading any of it
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify(error_handler.file_error('File too large')), 413
     
     try:
         # Rate limiting check
@@ -153,44 +322,49 @@ def upload_file():
             logger.logger.warning(f"Rate limit exceeded for IP: {client_ip}")
             return jsonify(error_handler.rate_limit_error()), 429
         
+        # Receive the upload under a temporary name; it is renamed once validated
+        # and removed on any early return
+        file_id = str(uuid.uuid4())
+        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.part")
+        filename, form = receive_upload(upload_path)
+        
         # Check if file is present
-        if 'file' not in request.files:
+        if filename is None:
             return jsonify(error_handler.validation_error('No file provided')), 400
         
-        file = request.files['file']
-        if file.filename == '':
+        if filename == '':
             return jsonify(error_handler.validation_error('No file selected')), 400
         
         # Security validation
-        if not security_validator.validate_filename(file.filename):
+        if not security_validator.validate_filename(filename):
             return jsonify(error_handler.file_error('Invalid filename')), 400
         
         # Get file extension
-        file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        if file_ext not in app.config['ALLOWED_EXTENSIONS']:
+        dot = filename.rfind('.')
+        file_ext = filename[dot + 1:].lower() if dot != -1 else ''
+        if file_ext not in ALLOWED_EXTENSIONS:
             return jsonify(error_handler.file_error(
-                f'Invalid file type. Supported formats: {", ".join(app.config["ALLOWED_EXTENSIONS"])}'
+                f'Invalid file type. Supported formats: {ALLOWED_EXTENSIONS_TEXT}'
             )), 400
         
-        # Read file data for validation
-        file_data = file.read()
-        file.seek(0)  # Reset file pointer
-        
-        # Validate file signature
-        if not security_validator.validate_file_signature(file_data, file_ext):
+        # Validate file signature (it lives in the first few bytes)
+        with open(upload_path, 'rb') as f:
+            header = f.read(32)
+        if not security_validator.validate_file_signature(header, file_ext):
             return jsonify(error_handler.file_error('File signature does not match extension')), 400
         
-        # Check file size
+        # Check the per-type size limit against the file as received, which
+        # covers chunked bodies and excludes the multipart overhead
         max_size = security_validator.MAX_FILE_SIZES.get(file_ext, app.config['MAX_CONTENT_LENGTH'])
-        if len(file_data) > max_size:
-            return jsonify(error_handler.file_error(f'File too large. Maximum size: {max_size // (1024*1024)}MB')), 400
+        if os.stat(upload_path).st_size > max_size:
+            return jsonify(error_handler.file_error(f'File too large. Maximum size: {max_size // (1024*1024)}MB')), 413
         
         # Get parameters from form
-        scale_factor = request.form.get('scale_factor', type=float)
-        target_width = request.form.get('target_width', type=int)
-        target_height = request.form.get('target_height', type=int)
-        interpolation = request.form.get('interpolation', 'ai_enhanced')
-        quality = request.form.get('quality', type=int, default=95)
+        scale_factor = form.get('scale_factor', type=float)
+        target_width = form.get('target_width', type=int)
+        target_height = form.get('target_height', type=int)
+        interpolation = form.get('interpolation', 'ai_enhanced')
+        quality = form.get('quality', type=int, default=95)
         
         # Validate parameters
         if scale_factor and (scale_factor < 0.1 or scale_factor > app.config['MAX_SCALE_FACTOR']):
@@ -211,18 +385,24 @@ def upload_file():
         if quality < 1 or quality > 100:
             return jsonify(error_handler.validation_error('Quality must be between 1 and 100')), 400
         
-        # Generate secure filename
-        file_id = str(uuid.uuid4())
-        secure_filename_base = security_validator.sanitize_filename(file.filename)
+        # Stored names come from the file id; the client's filename is never
+        # used on disk
         input_filename = f"{file_id}_input.{file_ext}"
         output_filename = f"{file_id}_output.{file_ext}"
         
-        # Save uploaded file
+        # Move uploaded file into place
         input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        file.save(input_path)
+        os.replace(upload_path, input_path)
         
-        # Validate image dimensions and content
+        # Record the extension so later lookups can build paths directly
+        cache.set(f'ext:{file_id}', file_ext, timeout=app.config['FILE_MAX_AGE'])
+        
+        # Validate image dimensions and content, running the malicious-content
+        # check alongside the dimension check
+        malicious_future = validation_executor.submit(security_validator.check_malicious_content, input_path)
         img_validation = security_validator.validate_image_dimensions(input_path)
+        is_malicious = malicious_future.result()
+        
         if not img_validation['valid']:
             os.remove(input_path)  # Clean up
             return jsonify(error_handler.file_error('Invalid image file')), 400
@@ -232,7 +412,7 @@ def upload_file():
             return jsonify(error_handler.file_error('Image dimensions exceed maximum limits')), 400
         
         # Check for malicious content
-        if security_validator.check_malicious_content(input_path):
+        if is_malicious:
             os.remove(input_path)  # Clean up
             return jsonify(error_handler.file_error('Suspicious image content detected')), 400
         
@@ -245,25 +425,71 @@ def upload_file():
             os.remove(input_path)  # Clean up
             return jsonify(error_handler.validation_error('; '.join(scale_validation['errors']))), 400
         
-        logger.logger.info(f"File uploaded: {file.filename} -> {input_filename}")
-        
-        # Initialize upscaler
-        upscaler = ImageUpscaler()
+        logger.logger.info(f"File uploaded: {filename} -> {input_filename}")
         
         # Prepare output path
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
         
-        # Upscale image
-        logger.logger.info(f"Starting upscaling with parameters: scale_factor={scale_factor}, interpolation={interpolation}, quality={quality}")
-        success = upscaler.upscale_image(
-            input_path=input_path,
-            output_path=output_path,
-            scale_factor=scale_factor,
-            target_width=target_width,
-            target_height=target_height,
-            interpolation=interpolation,
-            quality=quality
-        )
+        # Hand the job to a Celery worker when one is configured; the client
+        # polls /status/<file_id> (the task id) until it finishes
+        if upscale_task is not None and app.config['CELERY_BROKER_URL']:
+            queue = 'gpu_queue' if interpolation == 'ai_enhanced' else 'cpu_queue'
+            upscale_task.apply_async(
+                args=(input_path, output_path),
+                kwargs={
+                    'scale_factor': scale_factor,
+                    'target_width': target_width,
+                    'target_height': target_height,
+                    'interpolation': interpolation,
+                    'quality': quality
+                },
+                task_id=file_id,
+                queue=queue
+            )
+            logger.logger.info(f"Queued upscaling job {file_id} on {queue}")
+            
+            return jsonify({
+                'success': True,
+                'file_id': file_id,
+                'task_id': file_id,
+                'original_filename': filename,
+                'output_filename': output_filename,
+                'original_size': f"{img_validation['width']}x{img_validation['height']}",
+                'upscaled_size': f"{scale_validation['final_width']}x{scale_validation['final_height']}",
+                'status_url': f'/status/{file_id}',
+                'download_url': f'/download/{file_id}'
+            }), 202
+        
+        # Upscale image, reusing the output of an identical earlier upscale (same
+        # bytes and parameters) while it is still on disk. Only validated
+        # uploads upscaled here are hashed. The lookup happens under the lock
+        # so a duplicate of an in-flight request is reused too
+        result_key = (f"result:{security_validator.hash_file(input_path)}:"
+                      f"{scale_factor}:{target_width}:{target_height}:{interpolation}:{quality}")
+        with upscaler_lock:
+            success = False
+            cached_output = cache.get(result_key)
+            if cached_output:
+                try:
+                    shutil.copyfile(cached_output, output_path)
+                    logger.logger.info(f"Reusing upscaled output {os.path.basename(cached_output)}")
+                    success = True
+                except FileNotFoundError:
+                    # Cleaned up since it was cached, so upscale again
+                    cache.delete(result_key)
+            if not success:
+                logger.logger.info(f"Starting upscaling with parameters: scale_factor={scale_factor}, interpolation={interpolation}, quality={quality}")
+                success = upscaler.upscale_image(
+                    input_path=input_path,
+                    output_path=output_path,
+                    scale_factor=scale_factor,
+                    target_width=target_width,
+                    target_height=target_height,
+                    interpolation=interpolation,
+                    quality=quality
+                )
+                if success:
+                    cache.set(result_key, output_path, timeout=app.config['FILE_MAX_AGE'])
         
         processing_duration = time.time() - start_time
         logger.log_processing(
@@ -280,13 +506,14 @@ def upload_file():
             # Get file info
             file_size = os.path.getsize(output_path)
             
-            # Schedule cleanup
-            cleanup_old_files()
+            # Without APScheduler, piggyback cleanup on uploads
+            if BackgroundScheduler is None:
+                cleanup_old_files()
             
             return jsonify({
                 'success': True,
                 'file_id': file_id,
-                'original_filename': file.filename,
+                'original_filename': filename,
                 'output_filename': output_filename,
                 'file_size': file_size,
                 'original_size': f"{img_validation['width']}x{img_validation['height']}",
@@ -300,14 +527,42 @@ def upload_file():
             if os.path.exists(input_path):
                 os.remove(input_path)
             return jsonify(error_handler.processing_error('Failed to upscale image')), 500
+    
+    except RequestEntityTooLarge:
+        # A chunked body ran past MAX_CONTENT_LENGTH while it was being read
+        return jsonify(error_handler.file_error('File too large')), 413
             
     except Exception as e:
         logger.log_error(e, {
             'operation': 'file_upload',
-            'filename': file.filename if 'file' in locals() else 'unknown',
+            'filename': filename if 'filename' in locals() else 'unknown',
             'client_ip': get_remote_address()
         })
         return jsonify(error_handler.processing_error('Server error occurred')), 500
+    
+    finally:
+        if upload_path:
+            discard_file(upload_path)
+
+@app.route('/status/<file_id>')
+@limiter.limit("120 per minute")
+@handle_exceptions
+def job_status(file_id):
+    """Report the state of a queued upscaling job"""
+    if upscale_task is None or not app.config['CELERY_BROKER_URL']:
+        return jsonify(error_handler.validation_error('Background processing is disabled')), 404
+    
+    # Validate file_id format
+    if not is_valid_file_id(file_id):
+        return jsonify(error_handler.validation_error('Invalid file ID')), 400
+    
+    result = upscale_task.AsyncResult(file_id)
+    response = {'file_id': file_id, 'state': result.state}
+    if result.successful() and result.result:
+        response['download_url'] = f'/download/{file_id}'
+    elif result.ready():
+        response['error'] = 'Failed to upscale image'
+    return jsonify(response)
 
 @app.route('/download/<file_id>')
 @limiter.limit("20 per minute")
@@ -317,16 +572,13 @@ def download_file(file_id):
     """Download the upscaled image"""
     try:
         # Validate file_id format
-        if not file_id or len(file_id) != 36:  # UUID length
+        if not is_valid_file_id(file_id):
             return jsonify(error_handler.validation_error('Invalid file ID')), 400
         
         # Find the output file
-        output_dir = app.config['OUTPUT_FOLDER']
-        for filename in os.listdir(output_dir):
-            if filename.startswith(f"{file_id}_output."):
-                file_path = os.path.join(output_dir, filename)
-                if os.path.exists(file_path):
-                    return send_file(file_path, as_attachment=True)
+        file_path = find_file(app.config['OUTPUT_FOLDER'], file_id, 'output')
+        if file_path:
+            return send_output_file(file_path, as_attachment=True)
         
         return jsonify(error_handler.file_error('File not found')), 404
         
@@ -342,16 +594,14 @@ def preview_file(file_id):
     """Preview the upscaled image"""
     try:
         # Validate file_id format
-        if not file_id or len(file_id) != 36:  # UUID length
+        if not is_valid_file_id(file_id):
             return jsonify(error_handler.validation_error('Invalid file ID')), 400
         
         # Find the output file
-        output_dir = app.config['OUTPUT_FOLDER']
-        for filename in os.listdir(output_dir):
-            if filename.startswith(f"{file_id}_output."):
-                file_path = os.path.join(output_dir, filename)
-                if os.path.exists(file_path):
-                    return send_file(file_path)
+        file_path = find_file(app.config['OUTPUT_FOLDER'], file_id, 'output')
+        if file_path:
+            # Outputs never change once written, so browsers may keep them
+            return send_output_file(file_path, max_age=3600)
         
         return jsonify(error_handler.file_error('File not found')), 404
         
@@ -367,28 +617,19 @@ def cleanup_files(file_id):
     """Clean up uploaded and output files"""
     try:
         # Validate file_id format
-        if not file_id or len(file_id) != 36:  # UUID length
+        if not is_valid_file_id(file_id):
             return jsonify(error_handler.validation_error('Invalid file ID')), 400
         
         files_removed = 0
         
-        # Clean up input file
-        input_dir = app.config['UPLOAD_FOLDER']
-        for filename in os.listdir(input_dir):
-            if filename.startswith(f"{file_id}_input."):
-                file_path = os.path.join(input_dir, filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    files_removed += 1
-        
-        # Clean up output file
-        output_dir = app.config['OUTPUT_FOLDER']
-        for filename in os.listdir(output_dir):
-            if filename.startswith(f"{file_id}_output."):
-                file_path = os.path.join(output_dir, filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    files_removed += 1
+        # Clean up input and output files
+        for folder, suffix in ((app.config['UPLOAD_FOLDER'], 'input'),
+                               (app.config['OUTPUT_FOLDER'], 'output')):
+            file_path = find_file(folder, file_id, suffix)
+            if file_path:
+                os.remove(file_path)
+                files_removed += 1
+        cache.delete(f'ext:{file_id}')
         
         logger.logger.info(f"Cleaned up {files_removed} files for file_id: {file_id}")
         return jsonify({'success': True, 'files_removed': files_removed})
@@ -414,23 +655,27 @@ def internal_error(e):
     logger.log_error(e, {'operation': 'internal_error'})
     return jsonify(error_handler.processing_error('Internal server error')), 500
 
-# Security headers
+# Security headers, built once and added to every response
+SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'DENY'),
+    ('X-XSS-Protection', '1; mode=block'),
+    ('Strict-Transport-Security', 'max-age=31536000; includeSubDomains'),
+    ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+)
+
 @app.after_request
 def add_security_headers(response):
     """Add security headers to all responses"""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 if __name__ == '__main__':
     # Set startup time for metrics
     app.start_time = time.time()
     
-    # Start cleanup thread
-    cleanup_old_files()
+    # Start file cleanup (the scheduler runs its first pass at startup)
+    start_cleanup_scheduler()
     
     # Determine host and port
     host = os.environ.get('HOST', '0.0.0.0')
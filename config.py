@@ -11,21 +11,34 @@ class Config:
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     OUTPUT_FOLDER = os.environ.get('OUTPUT_FOLDER', 'outputs')
     
+    # Hand output downloads to nginx (X-Accel-Redirect) instead of streaming them
+    USE_X_ACCEL_REDIRECT = os.environ.get('USE_X_ACCEL_REDIRECT', 'false').lower() == 'true'
+    X_ACCEL_OUTPUT_PREFIX = os.environ.get('X_ACCEL_OUTPUT_PREFIX', '/internal_outputs/')
+    
     # Allowed file extensions
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'}
+    ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'))
     
     # Processing limits
     MAX_SCALE_FACTOR = float(os.environ.get('MAX_SCALE_FACTOR', 10.0))
     MAX_DIMENSION = int(os.environ.get('MAX_DIMENSION', 20000))
     
+    # Redis shared by all workers for caching and rate limiting (optional; the
+    # in-process defaults below are per worker)
+    REDIS_URL = os.environ.get('REDIS_URL')
+    
     # Rate limiting
-    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', REDIS_URL or 'memory://')
     RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', '100 per hour')
     
     # Caching
-    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', REDIS_URL)
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'RedisCache' if CACHE_REDIS_URL else 'SimpleCache')
     CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))
     
+    # Background processing (disabled unless a broker is configured)
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+    CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+    
     # Database
     DATABASE_URL = os.environ.get('DATABASE_URL')
     
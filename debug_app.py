@@ -1,20 +1,148 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, render_template, send_file
+import json
 import os
 import uuid
 import time
-import base64
 import tempfile
+import threading
+from contextlib import suppress
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from utils.logging import logger
+
+try:
+    from streaming_form_data import StreamingFormDataParser
+    from streaming_form_data.targets import FileTarget, ValueTarget
+except ImportError:
+    StreamingFormDataParser = None
+
+# Trace every request step by default; set LOG_LEVEL=INFO to skip the
+# debug records entirely. A child of the shared logger, so its records use
+# the shared handlers while the shared logger's level is left alone
+debug_logger = logger.logger.getChild('debug_app')
+debug_logger.setLevel(os.environ.get('LOG_LEVEL', 'DEBUG').upper())
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25MB max file size
 
+# Uploads only live for the length of a request, so keep them on tmpfs
+# where available
+SCRATCH = '/dev/shm/upscaler' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+os.makedirs(SCRATCH, exist_ok=True)
+
+# Upscaled images are kept here so /download can serve them from disk, and
+# removed by sweep_outputs once they are older than OUTPUT_MAX_AGE seconds
+OUTPUT_FOLDER = 'outputs'
+os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+OUTPUT_MAX_AGE = int(os.environ.get('OUTPUT_MAX_AGE', 3600))
+OUTPUT_SWEEP_INTERVAL = 600
+
+def schedule_output_sweep():
+    """Run sweep_outputs once OUTPUT_SWEEP_INTERVAL has passed"""
+    timer = threading.Timer(OUTPUT_SWEEP_INTERVAL, sweep_outputs)
+    timer.daemon = True
+    timer.start()
+
+def sweep_outputs():
+    """Remove outputs older than OUTPUT_MAX_AGE, then schedule the next sweep"""
+    cutoff = time.time() - OUTPUT_MAX_AGE
+    try:
+        with os.scandir(OUTPUT_FOLDER) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    # Another worker may have removed it first
+                    with suppress(FileNotFoundError):
+                        os.unlink(entry.path)
+                        debug_logger.debug("Removed old output: %s", entry.name)
+    except OSError as e:
+        debug_logger.warning("Output sweep failed: %s", e)
+    finally:
+        schedule_output_sweep()
+
+schedule_output_sweep()
+
+def find_output(file_id):
+    """
+    Path of the output for file_id, or None if there is none. Looked up on
+    disk so any worker can serve outputs written by another
+    """
+    prefix = f"{file_id}_output."
+    with os.scandir(OUTPUT_FOLDER) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix):
+                return entry.path
+    return None
+
 # Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'}
+ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'))
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def allowed_file(filename, _allowed=ALLOWED_EXTENSIONS):
+    dot = filename.rfind('.')
+    return dot != -1 and filename[dot + 1:].lower() in _allowed
+
+# Bodies of the fixed error responses, serialised once
+ERROR_BODIES = {
+    status: json.dumps({'error': message})
+    for status, message in ((404, 'Endpoint not found'),
+                            (413, 'File too large'),
+                            (500, 'Internal server error'))
+}
+
+def error_response(status):
+    """Build one of the fixed JSON error responses"""
+    return Response(ERROR_BODIES[status], status=status, mimetype='application/json')
+
+# Shared upscaler, created on first use. Its cached CLAHE and CUDA filter
+# objects keep internal buffers, so calls are serialised
+upscaler = None
+upscaler_lock = threading.Lock()
+
+def get_upscaler():
+    """Return the shared upscaler, creating it on first use"""
+    global upscaler
+    if upscaler is None:
+        with upscaler_lock:
+            if upscaler is None:
+                debug_logger.debug("Importing ImageUpscalePython...")
+                from ImageUpscalePython import ImageUpscaler
+                upscaler = ImageUpscaler()
+                debug_logger.info("ImageUpscaler initialized successfully")
+    return upscaler
+
+# Form fields accepted alongside the uploaded file
+FORM_FIELDS = ('scale_factor', 'target_width', 'target_height', 'interpolation', 'quality')
+
+def receive_upload(upload_path):
+    """
+    Write the uploaded 'file' part to upload_path and return (filename, form).
+    filename is None when the request has no file part.
+    """
+    if StreamingFormDataParser is None or request.mimetype != 'multipart/form-data':
+        debug_logger.debug("Parsing upload with Werkzeug")
+        file = request.files.get('file')
+        if file is None:
+            return None, request.form
+        file.save(upload_path)
+        return file.filename, request.form
+    
+    # Parse the body as it arrives so the file goes straight to disk
+    parser = StreamingFormDataParser(headers=request.headers)
+    file_target = FileTarget(upload_path)
+    parser.register('file', file_target)
+    fields = {name: ValueTarget() for name in FORM_FIELDS}
+    for name, target in fields.items():
+        parser.register(name, target)
+    
+    while True:
+        chunk = request.stream.read(64 * 1024)
+        if not chunk:
+            break
+        parser.data_received(chunk)
+    
+    form = MultiDict({name: target.value.decode() for name, target in fields.items() if target.value})
+    return file_target.multipart_filename, form
 
 @app.route('/')
 def index():
@@ -36,156 +164,163 @@ def upload_file():
     """Handle file upload and upscaling - Debug version"""
     start_time = time.time()
     
+    # Refuse oversized bodies from the declared length, before reading any of it
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        debug_logger.warning("Request too large: %d bytes", request.content_length)
+        return error_response(413)
+    
     try:
-        print("=== UPLOAD REQUEST START ===")
+        debug_logger.debug("=== UPLOAD REQUEST START ===")
+        
+        # Generate the file id and scratch paths up front so the upload can be
+        # streamed straight to disk; it is renamed once its type is known
+        file_id = str(uuid.uuid4())
+        upload_path = input_path = os.path.join(SCRATCH, f"{file_id}.part")
+        
+        debug_logger.debug("Receiving file to: %s", upload_path)
+        filename, form = receive_upload(upload_path)
         
         # Check if file is present
-        if 'file' not in request.files:
-            print("ERROR: No file in request")
+        if filename is None:
+            debug_logger.warning("No file in request")
             return jsonify({'error': 'No file provided'}), 400
         
-        file = request.files['file']
-        if file.filename == '':
-            print("ERROR: Empty filename")
+        if filename == '':
+            debug_logger.warning("Empty filename")
             return jsonify({'error': 'No file selected'}), 400
         
-        print(f"File received: {file.filename}")
+        debug_logger.debug("File received: %s", filename)
         
-        if not allowed_file(file.filename):
-            print(f"ERROR: Invalid file type: {file.filename}")
+        if not allowed_file(filename):
+            debug_logger.warning("Invalid file type: %s", filename)
             return jsonify({'error': 'Invalid file type. Supported formats: PNG, JPG, JPEG, BMP, TIFF, WebP'}), 400
         
         # Get parameters from form
-        scale_factor = request.form.get('scale_factor', type=float, default=2.0)
-        target_width = request.form.get('target_width', type=int)
-        target_height = request.form.get('target_height', type=int)
-        interpolation = request.form.get('interpolation', 'ai_enhanced')
-        quality = request.form.get('quality', type=int, default=95)
+        scale_factor = form.get('scale_factor', type=float, default=2.0)
+        target_width = form.get('target_width', type=int)
+        target_height = form.get('target_height', type=int)
+        interpolation = form.get('interpolation', 'ai_enhanced')
+        quality = form.get('quality', type=int, default=95)
         
-        print(f"Parameters: scale_factor={scale_factor}, interpolation={interpolation}, quality={quality}")
+        debug_logger.debug("Parameters: scale_factor=%s, interpolation=%s, quality=%s",
+                            scale_factor, interpolation, quality)
         
         # Validate parameters
         if scale_factor and (scale_factor < 0.1 or scale_factor > 5.0):
-            print(f"ERROR: Invalid scale factor: {scale_factor}")
+            debug_logger.warning("Invalid scale factor: %s", scale_factor)
             return jsonify({'error': 'Scale factor must be between 0.1 and 5.0'}), 400
         
         # Generate secure filename
-        file_id = str(uuid.uuid4())
-        file_ext = file.filename.rsplit('.', 1)[1].lower()
+        file_ext = filename[filename.rfind('.') + 1:].lower()
         input_filename = f"{file_id}_input.{file_ext}"
+        input_path = os.path.join(SCRATCH, input_filename)
         
-        # Create temp directory
-        temp_dir = tempfile.mkdtemp()
-        input_path = os.path.join(temp_dir, input_filename)
+        # Move uploaded file into place
+        os.replace(upload_path, input_path)
         
-        print(f"Saving file to: {input_path}")
+        debug_logger.debug("File saved successfully: %s", input_path)
         
-        # Save uploaded file
-        file.save(input_path)
-        
-        print(f"File saved successfully")
-        
-        # Test if we can import ImageUpscalePython
         try:
-            print("Testing ImageUpscalePython import...")
-            from ImageUpscalePython import ImageUpscaler
-            print("ImageUpscalePython imported successfully")
-            
-            # Initialize upscaler
-            upscaler = ImageUpscaler()
-            print("ImageUpscaler initialized successfully")
+            upscaler = get_upscaler()
             
             # Test basic functionality
             output_filename = f"{file_id}_output.{file_ext}"
-            output_path = os.path.join(temp_dir, output_filename)
+            output_path = os.path.join(OUTPUT_FOLDER, output_filename)
             
-            print(f"Starting upscaling to: {output_path}")
+            debug_logger.debug("Starting upscaling to: %s", output_path)
             
             # Upscale image
-            success = upscaler.upscale_image(
-                input_path=input_path,
-                output_path=output_path,
-                scale_factor=scale_factor,
-                target_width=target_width,
-                target_height=target_height,
-                interpolation=interpolation,
-                quality=quality
-            )
+            with upscaler_lock:
+                success = upscaler.upscale_image(
+                    input_path=input_path,
+                    output_path=output_path,
+                    scale_factor=scale_factor,
+                    target_width=target_width,
+                    target_height=target_height,
+                    interpolation=interpolation,
+                    quality=quality
+                )
             
             processing_duration = time.time() - start_time
-            print(f"Upscaling completed: success={success}, duration={processing_duration:.2f}s")
+            debug_logger.debug("Upscaling completed: success=%s, duration=%.2fs", success, processing_duration)
             
-            if success and os.path.exists(output_path):
-                # Read the output file and convert to base64
-                with open(output_path, 'rb') as f:
-                    output_data = f.read()
-                
-                # Convert to base64 for JSON response
-                output_base64 = base64.b64encode(output_data).decode('utf-8')
+            if success:
+                # upscale_image only reports success once imwrite has written
+                # the output, so a single stat gives its size. The client
+                # fetches the image from /download, so only metadata goes in
+                # the response
+                file_size = os.stat(output_path).st_size
                 
-                print(f"Success! Output size: {len(output_data)} bytes")
-                
-                # Clean up files
-                try:
-                    os.remove(input_path)
-                    os.remove(output_path)
-                    os.rmdir(temp_dir)
-                except:
-                    pass  # Ignore cleanup errors
+                debug_logger.debug("Success! Output size: %d bytes", file_size)
                 
                 return jsonify({
                     'success': True,
                     'file_id': file_id,
-                    'original_filename': file.filename,
+                    'original_filename': filename,
                     'output_filename': output_filename,
-                    'file_size': len(output_data),
+                    'file_size': file_size,
                     'processing_time': round(processing_duration, 2),
-                    'output_data': output_base64,
                     'download_url': f'/download/{file_id}'
                 })
             else:
-                print("Upscaling failed or output file not created")
-                # Clean up uploaded file
-                try:
-                    os.remove(input_path)
-                    os.rmdir(temp_dir)
-                except:
-                    pass
+                debug_logger.error("Upscaling failed")
                 return jsonify({'error': 'Failed to upscale image'}), 500
                 
         except Exception as e:
-            print(f"ERROR in ImageUpscalePython: {e}")
-            import traceback
-            traceback.print_exc()
-            
-            # Clean up uploaded file
-            try:
-                os.remove(input_path)
-                os.rmdir(temp_dir)
-            except:
-                pass
-            
+            logger.log_error(e, {'file_id': file_id, 'stage': 'upscale'})
             return jsonify({'error': f'Image processing error: {str(e)}'}), 500
+    
+    except RequestEntityTooLarge:
+        # A chunked body ran past MAX_CONTENT_LENGTH while it was being read
+        debug_logger.warning("Request body exceeded MAX_CONTENT_LENGTH")
+        return error_response(413)
             
     except Exception as e:
-        print(f"EXCEPTION in upload_file: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.log_error(e, {'function': 'upload_file'})
         return jsonify({'error': f'Server error: {str(e)}'}), 500
+    
+    finally:
+        # The upload is never needed after the request; the output is kept
+        with suppress(FileNotFoundError):
+            os.unlink(input_path)
+
+def send_output(file_id, as_attachment=False):
+    """
+    Send the output for file_id straight from disk. send_file goes through
+    wsgi.file_wrapper, so servers that support it use sendfile().
+    """
+    output_path = find_output(file_id)
+    try:
+        if output_path is not None:
+            return send_file(output_path, as_attachment=as_attachment, conditional=True)
+    except FileNotFoundError:
+        pass
+    debug_logger.warning("No output for %s", file_id)
+    return jsonify({'error': 'File not found'}), 404
+
+@app.route('/download/<file_id>')
+def download_file(file_id):
+    """Download the upscaled image"""
+    return send_output(file_id, as_attachment=True)
+
+@app.route('/preview/<file_id>')
+def preview_file(file_id):
+    """Preview the upscaled image"""
+    return send_output(file_id)
 
 @app.errorhandler(413)
 def too_large(e):
-    return jsonify({'error': 'File too large'}), 413
+    return error_response(413)
 
 @app.errorhandler(404)
 def not_found(e):
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return error_response(404)
 
 @app.errorhandler(500)
 def internal_error(e):
-    print(f"Internal error: {e}")
-    return jsonify({'error': 'Internal server error'}), 500
+    debug_logger.error("Internal error: %s", e)
+    return error_response(500)
 
 if __name__ == '__main__':
-    print("Starting DEBUG Image Upscaler...")
+    debug_logger.info("Starting DEBUG Image Upscaler...")
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,9 @@
+"""
+Gunicorn server hooks. Gunicorn reads this file from the working directory
+on startup, alongside any command-line settings.
+"""
+
+def post_worker_init(worker):
+    """Start file cleanup once the worker has imported the app"""
+    import app
+    app.start_cleanup_scheduler()
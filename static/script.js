@@ -200,10 +200,25 @@ function uploadFile() {
     })
     .then(response => {
         clearTimeout(timeoutId);
+        // Serverless deployments answer with the image itself and put the
+        // metadata in headers
+        const contentType = response.headers.get('Content-Type') || '';
+        if (response.ok && contentType.startsWith('image/')) {
+            return response.blob().then(blob => ({
+                success: true,
+                file_id: response.headers.get('X-File-Id'),
+                output_filename: response.headers.get('X-Output-Filename'),
+                output_url: URL.createObjectURL(blob)
+            }));
+        }
         return response.json();
     })
     .then(data => {
-        if (data.success) {
+        if (data.success && data.status_url) {
+            // Queued for a background worker
+            currentFileId = data.file_id;
+            pollStatus(data);
+        } else if (data.success) {
             currentFileId = data.file_id;
             showResults(data);
         } else {
@@ -221,6 +236,24 @@ function uploadFile() {
     });
 }
 
+function pollStatus(data) {
+    fetch(data.status_url)
+    .then(response => response.json())
+    .then(status => {
+        if (status.download_url) {
+            showResults(data);
+        } else if (status.error) {
+            showError(status.error);
+        } else {
+            setTimeout(() => pollStatus(data), 1000);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showError('Network error occurred. Please try again.');
+    });
+}
+
 function showResults(data) {
     processingSection.style.display = 'none';
     resultsSection.style.display = 'block';
@@ -246,9 +279,14 @@ function showResults(data) {
     const upscaledImg = document.getElementById('upscaledImage');
     const upscaledInfo = document.getElementById('upscaledInfo');
     
-    // Handle base64 data from Vercel
-    if (data.output_data) {
-        upscaledImg.src = `data:image/png;base64,${data.output_data}`;
+    // Handle image data returned with the upload response
+    if (data.output_url) {
+        upscaledImg.src = data.output_url;
+        upscaledImg.onload = function() {
+            upscaledInfo.textContent = `${this.naturalWidth} × ${this.naturalHeight} pixels`;
+        };
+    } else if (data.output_data) {
+        upscaledImg.src = `data:${data.output_mime || 'image/png'};base64,${data.output_data}`;
         upscaledImg.onload = function() {
             upscaledInfo.textContent = `${this.naturalWidth} × ${this.naturalHeight} pixels`;
         };
@@ -262,7 +300,14 @@ function showResults(data) {
     
     // Set download URL
     downloadBtn.onclick = () => {
-        window.open(`/download/${data.file_id}`, '_blank');
+        if (data.output_url) {
+            const link = document.createElement('a');
+            link.href = data.output_url;
+            link.download = data.output_filename || 'upscaled';
+            link.click();
+        } else {
+            window.open(`/download/${data.file_id}`, '_blank');
+        }
     };
 }
 
@@ -273,6 +318,10 @@ function downloadImage() {
 
 function resetApp() {
     // Reset state
+    const upscaledImg = document.getElementById('upscaledImage');
+    if (upscaledImg.src.startsWith('blob:')) {
+        URL.revokeObjectURL(upscaledImg.src);
+    }
     currentFile = null;
     currentFileId = null;
     fileInput.value = '';
@@ -0,0 +1,31 @@
+"""
+Celery tasks for running upscales outside the web workers.
+
+Start workers per queue, e.g.:
+    celery -A tasks worker -Q gpu_queue -c 1   # on GPU nodes
+    celery -A tasks worker -Q cpu_queue -c 8   # on CPU nodes
+"""
+import os
+from celery import Celery
+from ImageUpscalePython import ImageUpscaler
+from config import get_config
+
+config_class = get_config()
+celery = Celery('upscaler',
+                broker=config_class.CELERY_BROKER_URL,
+                backend=config_class.CELERY_RESULT_BACKEND)
+
+# One upscaler per worker process
+upscaler = None
+
+@celery.task
+def upscale_task(input_path: str, output_path: str, **params) -> bool:
+    """Upscale input_path into output_path; returns whether it succeeded"""
+    global upscaler
+    if upscaler is None:
+        upscaler = ImageUpscaler()
+
+    success = upscaler.upscale_image(input_path=input_path, output_path=output_path, **params)
+    if not success and os.path.exists(input_path):
+        os.remove(input_path)
+    return success
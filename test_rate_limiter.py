@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import time
+
+import pytest
+
+from utils import security
+from utils.security import RateLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable monotonic clock for the rate limiter"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(security, 'time', SimpleNamespace(monotonic=lambda: now.value,
+                                                          time=time.time))
+    return now
+
+def test_allows_up_to_limit(clock):
+    limiter = RateLimiter()
+    results = [limiter.is_allowed('client', limit=3, window=60) for _ in range(4)]
+
+    assert [r['allowed'] for r in results] == [True, True, True, False]
+    assert [r['remaining'] for r in results] == [2, 1, 0, 0]
+
+def test_allows_again_once_window_passes(clock):
+    limiter = RateLimiter()
+    limiter.is_allowed('client', limit=2, window=60)
+    clock.value += 30
+    limiter.is_allowed('client', limit=2, window=60)
+    assert not limiter.is_allowed('client', limit=2, window=60)['allowed']
+
+    # The first request leaves the window; the second is still in it
+    clock.value += 30
+    assert limiter.is_allowed('client', limit=2, window=60)['allowed']
+    assert not limiter.is_allowed('client', limit=2, window=60)['allowed']
+
+def test_denied_reset_time_is_when_oldest_request_expires(clock):
+    limiter = RateLimiter()
+    limiter.is_allowed('client', limit=1, window=60)
+    clock.value += 20
+
+    before = time.time()
+    result = limiter.is_allowed('client', limit=1, window=60)
+    assert not result['allowed']
+    assert before + 39 <= result['reset_time'] <= time.time() + 41
+
+def test_cleanup_drops_expired_identifiers(clock):
+    limiter = RateLimiter()
+    limiter.is_allowed('old', limit=5, window=60)
+    clock.value += 45
+    limiter.is_allowed('new', limit=5, window=60)
+    clock.value += 30
+
+    limiter._cleanup_old_entries(clock.value, 60)
+    tracked = {identifier for _, requests in limiter._shards for identifier in requests}
+    assert tracked == {'new'}
+
+def test_identifiers_are_limited_separately(clock):
+    limiter = RateLimiter()
+    assert limiter.is_allowed('a', limit=1, window=60)['allowed']
+    assert not limiter.is_allowed('a', limit=1, window=60)['allowed']
+    assert limiter.is_allowed('b', limit=1, window=60)['allowed']
+
+def test_concurrent_requests_respect_limit(clock):
+    """Requests racing on one shard are all counted"""
+    limiter = RateLimiter()
+    identifiers = [f'client-{i % 4}' for i in range(400)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: limiter.is_allowed(i, limit=50, window=60), identifiers))
+
+    allowed = [r['allowed'] for r in results]
+    assert allowed.count(True) == 4 * 50
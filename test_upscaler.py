@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+import pytest
+
+from ImageUpscalePython import ImageUpscaler
+from utils.security import SecurityValidator
+
+@pytest.fixture(scope='module')
+def upscaler():
+    return ImageUpscaler()
+
+def make_image(width, height, ext):
+    """Encode a noise image of the given size"""
+    img = np.random.default_rng(width * height).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(f'.{ext}', img)[1].tobytes()
+
+def decoded_size(data):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return img.shape[1], img.shape[0]
+
+@pytest.mark.parametrize('ext, interpolation, scale_factor, size', (
+    ('jpg', 'lanczos', 0.5, (77, 101)),            # reduced decode, odd size
+    ('png', 'ai_enhanced', 0.25, (101, 77)),       # reduced decode, odd size
+    ('jpeg', 'nearest', 0.5, (64, 48)),
+    ('tiff', 'area', 0.7, (101, 77)),
+    ('webp', 'cubic', 2.0, (77, 101)),
+    ('bmp', 'super_resolution', 1.5, (64, 48)),
+))
+def test_upscale_bytes_size(upscaler, ext, interpolation, scale_factor, size):
+    """The output has the size the API reports, odd sizes and reduced decodes included"""
+    width, height = size
+    output = upscaler.upscale_bytes(make_image(width, height, ext), ext,
+                                    scale_factor=scale_factor, interpolation=interpolation)
+
+    assert output is not None
+    expected = SecurityValidator.validate_scale_parameters(scale_factor, None, None, width, height)
+    assert decoded_size(output) == (expected['final_width'], expected['final_height'])
+    assert decoded_size(output) == (int(width * scale_factor), int(height * scale_factor))
+
+@pytest.mark.parametrize('target_width, target_height, expected', (
+    (120, None, (120, 157)),
+    (None, 50, (38, 50)),
+    (30, 40, (30, 40)),
+))
+def test_upscale_bytes_target_size(upscaler, target_width, target_height, expected):
+    output = upscaler.upscale_bytes(make_image(77, 101, 'png'), 'png', target_width=target_width,
+                                    target_height=target_height, interpolation='cubic')
+    assert decoded_size(output) == expected
+
+def test_upscale_bytes_output_format(upscaler):
+    """The output is encoded in the requested format, not the input's"""
+    output = upscaler.upscale_bytes(make_image(40, 30, 'png'), 'jpg', scale_factor=2.0,
+                                    interpolation='cubic')
+    assert output[:3] == b'\xff\xd8\xff'
+
+def test_upscale_bytes_matches_upscale_image(upscaler, tmp_path):
+    data = make_image(77, 101, 'png')
+    input_path = tmp_path / 'input.png'
+    output_path = tmp_path / 'output.png'
+    input_path.write_bytes(data)
+
+    assert upscaler.upscale_image(str(input_path), str(output_path), scale_factor=0.5,
+                                  interpolation='lanczos')
+    assert output_path.read_bytes() == upscaler.upscale_bytes(data, 'png', scale_factor=0.5,
+                                                              interpolation='lanczos')
+
+def test_upscale_bytes_invalid_input(upscaler):
+    assert upscaler.upscale_bytes(b'not an image', 'png', scale_factor=2.0) is None
+    assert upscaler.upscale_bytes(make_image(10, 10, 'png'), 'png', interpolation='bogus') is None
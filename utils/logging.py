@@ -1,12 +1,36 @@
 import os
 import logging
 import json
-from datetime import datetime
+import hashlib
 from typing import Dict, Any, Optional
 import traceback
-from functools import wraps
+from functools import lru_cache, wraps
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+if orjson is not None:
+    def _dumps(data: Dict[str, Any]) -> str:
+        """Serialize log data to JSON"""
+        return orjson.dumps(data).decode()
+else:
+    _dumps = json.dumps
+
+def error_id(error: Exception) -> str:
+    """Short ID for an exception, stable across processes and restarts"""
+    key = f"{type(error).__name__}:{error!s}".encode()
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(key)[:12]
+    return hashlib.blake2b(key, digest_size=6).hexdigest()
+
 class StructuredLogger:
     """Structured logging for production environments"""
     
@@ -50,9 +74,9 @@ class StructuredLogger:
         }
         
         if status_code >= 400:
-            self.logger.warning(json.dumps(log_data))
+            self.logger.warning(_dumps(log_data))
         else:
-            self.logger.info(json.dumps(log_data))
+            self.logger.info(_dumps(log_data))
     
     def log_error(self, error: Exception, context: Dict[str, Any] = None):
         """Log error with context"""
@@ -63,7 +87,7 @@ class StructuredLogger:
             'traceback': traceback.format_exc(),
             'context': context or {}
         }
-        self.logger.error(json.dumps(log_data))
+        self.logger.error(_dumps(log_data))
     
     def log_processing(self, file_id: str, operation: str, 
                       duration: float, success: bool, **kwargs):
@@ -78,9 +102,9 @@ class StructuredLogger:
         }
         
         if success:
-            self.logger.info(json.dumps(log_data))
+            self.logger.info(_dumps(log_data))
         else:
-            self.logger.error(json.dumps(log_data))
+            self.logger.error(_dumps(log_data))
 
 # Global logger instance
 logger = StructuredLogger('image_upscaler')
@@ -115,7 +139,9 @@ def handle_exceptions(f):
         try:
             return f(*args, **kwargs)
         except Exception as e:
+            short_id = error_id(e)
             logger.log_error(e, {
+                'error_id': short_id,
                 'function': f.__name__,
                 'args': str(args)[:200],  # Truncate for logging
                 'kwargs': str(kwargs)[:200]
@@ -124,11 +150,20 @@ def handle_exceptions(f):
             from flask import jsonify
             return jsonify({
                 'error': 'Internal server error',
-                'error_id': str(hash(str(e)))[:8]  # Short error ID for tracking
+                'error_id': short_id  # Short error ID for tracking
             }), 500
     
     return decorated_function
 
+@lru_cache(maxsize=1)
+def _iso_timestamp(second: int) -> str:
+    """ISO 8601 UTC timestamp for a whole second, formatted once per second"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+
+def utc_timestamp() -> str:
+    """Current UTC time as an ISO 8601 string, to the second"""
+    return _iso_timestamp(int(time.time()))
+
 class ErrorHandler:
     """Centralized error handling"""
     
@@ -139,7 +174,7 @@ class ErrorHandler:
             'error': 'Validation error',
             'message': message,
             'field': field,
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': utc_timestamp()
         }
     
     @staticmethod
@@ -149,7 +184,7 @@ class ErrorHandler:
             'error': 'File error',
             'message': message,
             'file_type': file_type,
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': utc_timestamp()
         }
     
     @staticmethod
@@ -159,7 +194,7 @@ class ErrorHandler:
             'error': 'Processing error',
             'message': message,
             'operation': operation,
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': utc_timestamp()
         }
     
     @staticmethod
@@ -169,7 +204,7 @@ class ErrorHandler:
             'error': 'Rate limit exceeded',
             'message': message,
             'retry_after': 3600,  # 1 hour
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': utc_timestamp()
         }
 
 # Global error handler instance
@@ -1,12 +1,18 @@
 import os
 import re
+import time
 import hashlib
 import secrets
-from typing import Optional, Dict, Any
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, BinaryIO, Union
 from werkzeug.utils import secure_filename
 from PIL import Image
-import cv2
-import numpy as np
+
+try:
+    import imagesize
+except ImportError:
+    imagesize = None
 
 class SecurityValidator:
     """Security validation utilities"""
@@ -21,6 +27,18 @@ class SecurityValidator:
         'webp': [b'RIFF', b'WEBP']
     }
     
+    # Same signatures as tuples, so one bytes.startswith call checks them all
+    _SIGNATURE_TUPLES = {ext: tuple(sigs) for ext, sigs in FILE_SIGNATURES.items()}
+    
+    # Dangerous filename patterns, compiled once into a single alternation
+    _DANGEROUS_FILENAME = re.compile('|'.join([
+        r'\.\.',  # Path traversal
+        r'[<>:"|?*]',  # Invalid characters
+        r'^(?:CON|PRN|AUX|NUL|COM[1-9]|LPT[1-9])$',  # Windows reserved names
+        r'^\.',  # Hidden files
+        r'\.(?:exe|bat|cmd|scr|pif|com)$'  # Executable extensions
+    ]), re.IGNORECASE)
+    
     # Maximum file sizes by type (in bytes)
     MAX_FILE_SIZES = {
         'png': 50 * 1024 * 1024,  # 50MB
@@ -38,45 +56,51 @@ class SecurityValidator:
             return False
         
         # Check for dangerous patterns
-        dangerous_patterns = [
-            r'\.\.',  # Path traversal
-            r'[<>:"|?*]',  # Invalid characters
-            r'^(CON|PRN|AUX|NUL|COM[1-9]|LPT[1-9])$',  # Windows reserved names
-            r'^\.',  # Hidden files
-            r'\.(exe|bat|cmd|scr|pif|com)$'  # Executable extensions
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, filename, re.IGNORECASE):
-                return False
-        
-        return True
+        return SecurityValidator._DANGEROUS_FILENAME.search(filename) is None
     
     @staticmethod
     def validate_file_signature(file_data: bytes, expected_ext: str) -> bool:
         """Validate file signature matches extension"""
-        if expected_ext.lower() not in SecurityValidator.FILE_SIGNATURES:
-            return False
-        
-        signatures = SecurityValidator.FILE_SIGNATURES[expected_ext.lower()]
-        return any(file_data.startswith(sig) for sig in signatures)
+        signatures = SecurityValidator._SIGNATURE_TUPLES.get(expected_ext.lower())
+        return signatures is not None and file_data.startswith(signatures)
     
     @staticmethod
-    def validate_image_dimensions(image_path: str, max_width: int = 20000, 
+    def read_image_size(image_path: Union[str, BinaryIO]) -> tuple:
+        """
+        Read (width, height) from the image header without decoding pixels.
+        Accepts a path or a seekable binary file object. The size is as
+        stored, before any EXIF rotation, the same as Pillow reports it
+        """
+        # imagesize parses only the header bytes (Pillow decodes WebP just
+        # to report its size); Pillow handles what imagesize cannot read
+        width, height = -1, -1
+        if imagesize is not None:
+            try:
+                width, height = imagesize.get(image_path, exif_rotation=False)
+            except Exception:
+                pass  # Left to Pillow
+        if width <= 0 or height <= 0:
+            if hasattr(image_path, 'seek'):
+                image_path.seek(0)
+            with Image.open(image_path) as img:
+                width, height = img.size
+        return width, height
+    
+    @staticmethod
+    def validate_image_dimensions(image_path: Union[str, BinaryIO], max_width: int = 20000, 
                                  max_height: int = 20000) -> Dict[str, Any]:
         """Validate image dimensions"""
         try:
-            with Image.open(image_path) as img:
-                width, height = img.size
-                
-                return {
-                    'valid': True,
-                    'width': width,
-                    'height': height,
-                    'aspect_ratio': width / height,
-                    'pixel_count': width * height,
-                    'within_limits': width <= max_width and height <= max_height
-                }
+            width, height = SecurityValidator.read_image_size(image_path)
+            
+            return {
+                'valid': True,
+                'width': width,
+                'height': height,
+                'aspect_ratio': width / height,
+                'pixel_count': width * height,
+                'within_limits': width <= max_width and height <= max_height
+            }
         except Exception as e:
             return {
                 'valid': False,
@@ -160,16 +184,24 @@ class SecurityValidator:
         return hashlib.sha256(file_data).hexdigest()
     
     @staticmethod
-    def check_malicious_content(image_path: str) -> bool:
+    def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+        """Generate a BLAKE2b hash of a file on disk, read in chunks"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    @staticmethod
+    def check_malicious_content(image_path: Union[str, BinaryIO]) -> bool:
         """Check for potentially malicious image content"""
         try:
-            # Try to load with OpenCV
-            img = cv2.imread(image_path)
-            if img is None:
-                return True  # Suspicious if can't load
+            # Only the header is read; a file whose header can't be parsed
+            # raises and is treated as suspicious. Corrupt pixel data still
+            # fails later when the upscaler decodes it
+            width, height = SecurityValidator.read_image_size(image_path)
             
             # Check for extremely large dimensions that might cause DoS
-            height, width = img.shape[:2]
             if width > 50000 or height > 50000:
                 return True
             
@@ -184,61 +216,81 @@ class SecurityValidator:
             return True  # Suspicious if any error occurs
 
 class RateLimiter:
-    """Simple in-memory rate limiter"""
+    """Simple in-memory rate limiter, safe to share between threads"""
+    
+    # Identifiers are spread over this many independently locked tables
+    SHARD_COUNT = 16
     
     def __init__(self):
-        self.requests = {}
+        self._shards = [(threading.Lock(), {}) for _ in range(self.SHARD_COUNT)]
         self.cleanup_interval = 3600  # 1 hour
-        self.last_cleanup = 0
+        self._max_window = 0
+        self._schedule_cleanup()
     
     def is_allowed(self, identifier: str, limit: int = 100, 
                   window: int = 3600) -> Dict[str, Any]:
         """Check if request is allowed based on rate limit"""
-        current_time = time.time()
-        
-        # Cleanup old entries periodically
-        if current_time - self.last_cleanup > self.cleanup_interval:
-            self._cleanup_old_entries(current_time, window)
-            self.last_cleanup = current_time
-        
-        # Get or create request history for identifier
-        if identifier not in self.requests:
-            self.requests[identifier] = []
-        
-        request_times = self.requests[identifier]
-        
-        # Remove old requests outside the window
-        cutoff_time = current_time - window
-        request_times[:] = [t for t in request_times if t > cutoff_time]
-        
-        # Check if limit exceeded
-        if len(request_times) >= limit:
-            return {
-                'allowed': False,
-                'limit': limit,
-                'remaining': 0,
-                'reset_time': min(request_times) + window
-            }
+        # Monotonic time is immune to wall-clock adjustments
+        current_time = time.monotonic()
+        self._max_window = max(self._max_window, window)
         
-        # Add current request
-        request_times.append(current_time)
+        lock, requests = self._shards[hash(identifier) % self.SHARD_COUNT]
+        with lock:
+            # Get or create request history for identifier
+            request_times = requests.get(identifier)
+            if request_times is None:
+                request_times = requests[identifier] = deque()
+            
+            # Remove old requests outside the window; times are appended in
+            # order, so expired ones are always at the front
+            cutoff_time = current_time - window
+            while request_times and request_times[0] <= cutoff_time:
+                request_times.popleft()
+            
+            # Check if limit exceeded
+            if len(request_times) >= limit:
+                wait_time = request_times[0] + window - current_time
+                return {
+                    'allowed': False,
+                    'limit': limit,
+                    'remaining': 0,
+                    'reset_time': time.time() + wait_time
+                }
+            
+            # Add current request
+            request_times.append(current_time)
+            remaining = limit - len(request_times)
         
         return {
             'allowed': True,
             'limit': limit,
-            'remaining': limit - len(request_times),
-            'reset_time': current_time + window
+            'remaining': remaining,
+            'reset_time': time.time() + window
         }
     
+    def _schedule_cleanup(self):
+        """Run the next cleanup on a background timer, off the request path"""
+        timer = threading.Timer(self.cleanup_interval, self._run_cleanup)
+        timer.daemon = True
+        timer.start()
+    
+    def _run_cleanup(self):
+        try:
+            self._cleanup_old_entries(time.monotonic(), self._max_window)
+        finally:
+            self._schedule_cleanup()
+    
     def _cleanup_old_entries(self, current_time: float, window: int):
         """Clean up old entries to prevent memory leaks"""
         cutoff_time = current_time - window
-        for identifier in list(self.requests.keys()):
-            self.requests[identifier] = [
-                t for t in self.requests[identifier] if t > cutoff_time
-            ]
-            if not self.requests[identifier]:
-                del self.requests[identifier]
+        for lock, requests in self._shards:
+            with lock:
+                for identifier in list(requests.keys()):
+                    request_times = requests[identifier]
+                    while request_times and request_times[0] <= cutoff_time:
+                        request_times.popleft()
+                    if not request_times:
+                        del requests[identifier]
 
 # Global instances
 security_validator = SecurityValidator()
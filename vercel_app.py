@@ -1,22 +1,91 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, Request, Response, request, jsonify, render_template
+from flask.json.provider import DefaultJSONProvider
 import os
-import uuid
+import json
 import time
-import base64
+import itertools
+import threading
+import mimetypes
 import tempfile
 from ImageUpscalePython import ImageUpscaler
 from config import get_config
 from utils.logging import logger, log_request_duration, handle_exceptions, error_handler
 from utils.security import security_validator
 
+# pybase64 has SIMD encoders and the same API as the standard module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes responses with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS).decode()
+    
+    def response(self, *args, **kwargs):
+        # The base64 image in ?format=json responses runs to megabytes, so
+        # orjson's bytes go into the response without a round trip via str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS),
+            mimetype=self.mimetype
+        )
+
+class UploadRequest(Request):
+    """Request that keeps uploads of up to 8MB in memory while parsing"""
+    
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        # Werkzeug spills to a temp file past 500KB; most images fit well
+        # under 8MB, so they never touch the small /tmp on Vercel
+        return tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='rb+')
+
 # Initialize Flask app with configuration
 config_class = get_config()
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object(config_class)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Allowed extensions, bound once along with the text used in error messages
+ALLOWED_EXTENSIONS = app.config['ALLOWED_EXTENSIONS']
+ALLOWED_EXTENSIONS_TEXT = ", ".join(sorted(ALLOWED_EXTENSIONS))
+
+# Size limit per allowed extension, falling back to the request limit
+MAX_UPLOAD_SIZES = {
+    ext: security_validator.MAX_FILE_SIZES.get(ext, app.config['MAX_CONTENT_LENGTH'])
+    for ext in ALLOWED_EXTENSIONS
+}
+
+# Accepted range and error message for each numeric form parameter
+PARAM_LIMITS = (
+    ('scale_factor', 0.1, app.config['MAX_SCALE_FACTOR'],
+     f'Scale factor must be between 0.1 and {app.config["MAX_SCALE_FACTOR"]}'),
+    ('target_width', 1, app.config['MAX_DIMENSION'],
+     f'Target width must be between 1 and {app.config["MAX_DIMENSION"]} pixels'),
+    ('target_height', 1, app.config['MAX_DIMENSION'],
+     f'Target height must be between 1 and {app.config["MAX_DIMENSION"]} pixels'),
+    ('quality', 1, 100, 'Quality must be between 1 and 100'),
+)
 
-# Create temporary directories for Vercel
-temp_upload_dir = tempfile.mkdtemp()
-temp_output_dir = tempfile.mkdtemp()
+# File ids only label a response (nothing is stored under them), so a
+# per-process prefix and a counter are enough to keep them distinct
+FILE_ID_PREFIX = f"{os.getpid():x}{time.time_ns():x}"
+file_id_counter = itertools.count(1)
+
+# Shared upscaler, built once per process so warm invocations reuse it. Its
+# cached CLAHE and CUDA filter objects keep internal buffers, so calls are
+# serialised
+upscaler = ImageUpscaler()
+upscaler_lock = threading.Lock()
 
 @app.route('/')
 def index():
@@ -54,23 +123,25 @@ def upload_file():
             return jsonify(error_handler.file_error('Invalid filename')), 400
         
         # Get file extension
-        file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        if file_ext not in app.config['ALLOWED_EXTENSIONS']:
+        dot = file.filename.rfind('.')
+        file_ext = file.filename[dot + 1:].lower() if dot != -1 else ''
+        if file_ext not in ALLOWED_EXTENSIONS:
             return jsonify(error_handler.file_error(
-                f'Invalid file type. Supported formats: {", ".join(app.config["ALLOWED_EXTENSIONS"])}'
+                f'Invalid file type. Supported formats: {ALLOWED_EXTENSIONS_TEXT}'
             )), 400
         
-        # Read file data for validation
-        file_data = file.read()
-        file.seek(0)  # Reset file pointer
-        
-        # Validate file signature
-        if not security_validator.validate_file_signature(file_data, file_ext):
+        # Validate file signature (it lives in the first few bytes)
+        header = file.stream.read(16)
+        file.stream.seek(0)
+        if not security_validator.validate_file_signature(header, file_ext):
             return jsonify(error_handler.file_error('File signature does not match extension')), 400
         
-        # Check file size
-        max_size = security_validator.MAX_FILE_SIZES.get(file_ext, app.config['MAX_CONTENT_LENGTH'])
-        if len(file_data) > max_size:
+        # Check file size. Werkzeug has already spooled the part, so seeking
+        # to the end gives its size without reading it
+        file_size = file.stream.seek(0, os.SEEK_END)
+        file.stream.seek(0)
+        max_size = MAX_UPLOAD_SIZES[file_ext]
+        if file_size > max_size:
             return jsonify(error_handler.file_error(f'File too large. Maximum size: {max_size // (1024*1024)}MB')), 400
         
         # Get parameters from form
@@ -80,47 +151,29 @@ def upload_file():
         interpolation = request.form.get('interpolation', 'ai_enhanced')
         quality = request.form.get('quality', type=int, default=95)
         
-        # Validate parameters
-        if scale_factor and (scale_factor < 0.1 or scale_factor > app.config['MAX_SCALE_FACTOR']):
-            return jsonify(error_handler.validation_error(
-                f'Scale factor must be between 0.1 and {app.config["MAX_SCALE_FACTOR"]}'
-            )), 400
-        
-        if target_width and (target_width < 1 or target_width > app.config['MAX_DIMENSION']):
-            return jsonify(error_handler.validation_error(
-                f'Target width must be between 1 and {app.config["MAX_DIMENSION"]} pixels'
-            )), 400
-        
-        if target_height and (target_height < 1 or target_height > app.config['MAX_DIMENSION']):
-            return jsonify(error_handler.validation_error(
-                f'Target height must be between 1 and {app.config["MAX_DIMENSION"]} pixels'
-            )), 400
+        # Validate parameters; the first one out of range is reported
+        for (name, low, high, message), value in zip(
+                PARAM_LIMITS, (scale_factor, target_width, target_height, quality)):
+            if value is not None and not low <= value <= high:
+                return jsonify(error_handler.validation_error(message, name)), 400
         
-        if quality < 1 or quality > 100:
-            return jsonify(error_handler.validation_error('Quality must be between 1 and 100')), 400
-        
-        # Generate secure filename
-        file_id = str(uuid.uuid4())
-        input_filename = f"{file_id}_input.{file_ext}"
+        # Generate output filename
+        file_id = f"{FILE_ID_PREFIX}-{next(file_id_counter):x}"
         output_filename = f"{file_id}_output.{file_ext}"
         
-        # Save uploaded file to temp directory
-        input_path = os.path.join(temp_upload_dir, input_filename)
-        file.save(input_path)
-        
-        # Validate image dimensions and content
-        img_validation = security_validator.validate_image_dimensions(input_path)
+        # Validate image dimensions and content. Only the header is parsed,
+        # straight from the spooled upload, so rejected images are never
+        # read in full
+        img_validation = security_validator.validate_image_dimensions(file.stream)
         if not img_validation['valid']:
-            os.remove(input_path)  # Clean up
             return jsonify(error_handler.file_error('Invalid image file')), 400
         
         if not img_validation['within_limits']:
-            os.remove(input_path)  # Clean up
             return jsonify(error_handler.file_error('Image dimensions exceed maximum limits')), 400
         
         # Check for malicious content
-        if security_validator.check_malicious_content(input_path):
-            os.remove(input_path)  # Clean up
+        file.stream.seek(0)
+        if security_validator.check_malicious_content(file.stream):
             return jsonify(error_handler.file_error('Suspicious image content detected')), 400
         
         # Validate scaling parameters
@@ -129,28 +182,27 @@ def upload_file():
             img_validation['width'], img_validation['height']
         )
         if not scale_validation['valid']:
-            os.remove(input_path)  # Clean up
             return jsonify(error_handler.validation_error('; '.join(scale_validation['errors']))), 400
         
-        logger.logger.info(f"File uploaded: {file.filename} -> {input_filename}")
-        
-        # Initialize upscaler
-        upscaler = ImageUpscaler()
+        logger.logger.info(f"File uploaded: {file.filename} -> {file_id}")
         
-        # Prepare output path
-        output_path = os.path.join(temp_output_dir, output_filename)
+        # Work on the upload in memory; nothing is written to disk
+        file.stream.seek(0)
+        img_bytes = file.read()
         
         # Upscale image
         logger.logger.info(f"Starting upscaling with parameters: scale_factor={scale_factor}, interpolation={interpolation}, quality={quality}")
-        success = upscaler.upscale_image(
-            input_path=input_path,
-            output_path=output_path,
-            scale_factor=scale_factor,
-            target_width=target_width,
-            target_height=target_height,
-            interpolation=interpolation,
-            quality=quality
-        )
+        with upscaler_lock:
+            output_data = upscaler.upscale_bytes(
+                img_bytes,
+                file_ext,
+                scale_factor=scale_factor,
+                target_width=target_width,
+                target_height=target_height,
+                interpolation=interpolation,
+                quality=quality
+            )
+        success = output_data is not None
         
         processing_duration = time.time() - start_time
         logger.log_processing(
@@ -163,18 +215,21 @@ def upload_file():
             interpolation=interpolation
         )
         
-        if success:
-            # Read the output file and convert to base64 for Vercel
-            with open(output_path, 'rb') as f:
-                output_data = f.read()
-            
-            # Convert to base64 for JSON response
+        if success and request.args.get('format') != 'json':
+            # Send the image itself with the metadata in headers
+            response = Response(output_data, mimetype=mimetypes.guess_type(output_filename)[0])
+            response.headers.update({
+                'X-File-Id': file_id,
+                'X-Output-Filename': output_filename,
+                'X-Original-Size': f"{img_validation['width']}x{img_validation['height']}",
+                'X-Upscaled-Size': f"{scale_validation['final_width']}x{scale_validation['final_height']}",
+                'X-Processing-Time': str(round(processing_duration, 2))
+            })
+            return response
+        elif success:
+            # ?format=json: the image inlined as base64, for older clients
             output_base64 = base64.b64encode(output_data).decode('utf-8')
             
-            # Clean up files
-            os.remove(input_path)
-            os.remove(output_path)
-            
             return jsonify({
                 'success': True,
                 'file_id': file_id,
@@ -188,10 +243,7 @@ def upload_file():
                 'download_url': f'/download/{file_id}'
             })
         else:
-            logger.logger.error("Upscaling failed - cleaning up uploaded file")
-            # Clean up uploaded file
-            if os.path.exists(input_path):
-                os.remove(input_path)
+            logger.logger.error("Upscaling failed")
             return jsonify(error_handler.processing_error('Failed to upscale image')), 500
             
     except Exception as e:
@@ -201,15 +253,22 @@ def upload_file():
         })
         return jsonify(error_handler.processing_error('Server error occurred')), 500
 
+# Body of the download/preview responses, serialised once since it never changes
+NO_STORED_OUTPUT_BODY = json.dumps({'error': 'The upscaled image is returned by the upload response for Vercel deployment'})
+
+def no_stored_output():
+    """Build the response for routes that need an output this app does not store"""
+    return Response(NO_STORED_OUTPUT_BODY, status=400, mimetype='application/json')
+
 @app.route('/download/<file_id>')
 def download_file(file_id):
-    """Download the upscaled image - returns base64 data"""
-    return jsonify({'error': 'Use the output_data from upload response for Vercel deployment'}), 400
+    """Download the upscaled image - not stored on Vercel"""
+    return no_stored_output()
 
 @app.route('/preview/<file_id>')
 def preview_file(file_id):
-    """Preview the upscaled image - returns base64 data"""
-    return jsonify({'error': 'Use the output_data from upload response for Vercel deployment'}), 400
+    """Preview the upscaled image - not stored on Vercel"""
+    return no_stored_output()
 
 @app.errorhandler(413)
 def too_large(e):
@@ -224,14 +283,18 @@ def internal_error(e):
     logger.log_error(e, {'operation': 'internal_error'})
     return jsonify(error_handler.processing_error('Internal server error')), 500
 
-# Security headers
+# Security headers, built once and added to every response
+SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'DENY'),
+    ('X-XSS-Protection', '1; mode=block'),
+    ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+)
+
 @app.after_request
 def add_security_headers(response):
     """Add security headers to all responses"""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 if __name__ == '__main__':
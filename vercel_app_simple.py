@@ -1,25 +1,55 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Request, Response, request, jsonify, render_template
 import os
-import uuid
+import json
 import time
-import base64
+import itertools
+import threading
+import mimetypes
 import tempfile
 from ImageUpscalePython import ImageUpscaler
 from werkzeug.utils import secure_filename
 
+# pybase64 has SIMD encoders and the same API as the standard module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+class UploadRequest(Request):
+    """Request that keeps uploads of up to 8MB in memory while parsing"""
+    
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        # Werkzeug spills to a temp file past 500KB; most images fit well
+        # under 8MB, so they never touch the small /tmp on Vercel
+        return tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='rb+')
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25MB max file size
 
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'}
+# File ids only label a response (nothing is stored under them), so a
+# per-process prefix and a counter are enough to keep them distinct
+FILE_ID_PREFIX = f"{os.getpid():x}{time.time_ns():x}"
+file_id_counter = itertools.count(1)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Shared upscaler, built once per process so warm invocations reuse it. Its
+# cached CLAHE and CUDA filter objects keep internal buffers, so calls are
+# serialised
+upscaler = ImageUpscaler()
+upscaler_lock = threading.Lock()
 
-# Create temporary directories for Vercel
-temp_upload_dir = tempfile.mkdtemp()
-temp_output_dir = tempfile.mkdtemp()
+# Allowed file extensions
+ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'))
+
+# Accepted range and error message for each numeric form parameter
+PARAM_LIMITS = (
+    ('scale_factor', 0.1, 5.0, 'Scale factor must be between 0.1 and 5.0'),
+    ('target_width', 1, 10000, 'Target width must be between 1 and 10000 pixels'),
+    ('target_height', 1, 10000, 'Target height must be between 1 and 10000 pixels'),
+    ('quality', 1, 100, 'Quality must be between 1 and 100'),
+)
 
 @app.route('/')
 def index():
@@ -50,7 +80,10 @@ def upload_file():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        if not allowed_file(file.filename):
+        # Get file extension, parsed once for the check and the output name
+        dot = file.filename.rfind('.')
+        file_ext = file.filename[dot + 1:].lower() if dot != -1 else ''
+        if file_ext not in ALLOWED_EXTENSIONS:
             return jsonify({'error': 'Invalid file type. Supported formats: PNG, JPG, JPEG, BMP, TIFF, WebP'}), 400
         
         # Get parameters from form
@@ -60,68 +93,52 @@ def upload_file():
         interpolation = request.form.get('interpolation', 'ai_enhanced')
         quality = request.form.get('quality', type=int, default=95)
         
-        # Validate parameters
-        if scale_factor and (scale_factor < 0.1 or scale_factor > 5.0):
-            return jsonify({'error': 'Scale factor must be between 0.1 and 5.0'}), 400
-        
-        if target_width and (target_width < 1 or target_width > 10000):
-            return jsonify({'error': 'Target width must be between 1 and 10000 pixels'}), 400
-        
-        if target_height and (target_height < 1 or target_height > 10000):
-            return jsonify({'error': 'Target height must be between 1 and 10000 pixels'}), 400
+        # Validate parameters; the first one out of range is reported
+        for (_, low, high, message), value in zip(
+                PARAM_LIMITS, (scale_factor, target_width, target_height, quality)):
+            if value is not None and not low <= value <= high:
+                return jsonify({'error': message}), 400
         
-        if quality < 1 or quality > 100:
-            return jsonify({'error': 'Quality must be between 1 and 100'}), 400
-        
-        # Generate secure filename
-        file_id = str(uuid.uuid4())
-        file_ext = file.filename.rsplit('.', 1)[1].lower()
-        input_filename = f"{file_id}_input.{file_ext}"
+        # Generate output filename
+        file_id = f"{FILE_ID_PREFIX}-{next(file_id_counter):x}"
         output_filename = f"{file_id}_output.{file_ext}"
         
-        # Save uploaded file to temp directory
-        input_path = os.path.join(temp_upload_dir, input_filename)
-        file.save(input_path)
-        
-        print(f"File saved to: {input_path}")
+        # Work on the upload in memory; nothing is written to disk
+        img_bytes = file.read()
         
-        # Initialize upscaler
-        upscaler = ImageUpscaler()
-        
-        # Prepare output path
-        output_path = os.path.join(temp_output_dir, output_filename)
+        print(f"File received: {len(img_bytes)} bytes")
         
         print(f"Starting upscaling...")
         
         # Upscale image
-        success = upscaler.upscale_image(
-            input_path=input_path,
-            output_path=output_path,
-            scale_factor=scale_factor,
-            target_width=target_width,
-            target_height=target_height,
-            interpolation=interpolation,
-            quality=quality
-        )
+        with upscaler_lock:
+            output_data = upscaler.upscale_bytes(
+                img_bytes,
+                file_ext,
+                scale_factor=scale_factor,
+                target_width=target_width,
+                target_height=target_height,
+                interpolation=interpolation,
+                quality=quality
+            )
+        success = output_data is not None
         
         processing_duration = time.time() - start_time
         print(f"Upscaling completed: success={success}, duration={processing_duration:.2f}s")
         
-        if success:
-            # Read the output file and convert to base64 for Vercel
-            with open(output_path, 'rb') as f:
-                output_data = f.read()
-            
-            # Convert to base64 for JSON response
+        if success and request.args.get('format') != 'json':
+            # Send the image itself with the metadata in headers
+            response = Response(output_data, mimetype=mimetypes.guess_type(output_filename)[0])
+            response.headers.update({
+                'X-File-Id': file_id,
+                'X-Output-Filename': output_filename,
+                'X-Processing-Time': str(round(processing_duration, 2))
+            })
+            return response
+        elif success:
+            # ?format=json: the image inlined as base64, for older clients
             output_base64 = base64.b64encode(output_data).decode('utf-8')
             
-            # Clean up files
-            try:
-                os.remove(input_path)
-                os.remove(output_path)
-            except:
-                pass  # Ignore cleanup errors
-            
             return jsonify({
                 'success': True,
                 'file_id': file_id,
@@ -134,28 +151,28 @@ def upload_file():
             })
         else:
             print("Upscaling failed")
-            # Clean up uploaded file
-            try:
-                os.remove(input_path)
-            except:
-                pass
             return jsonify({'error': 'Failed to upscale image'}), 500
             
     except Exception as e:
-        print(f"Exception in upload_file: {e}")
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("Exception in upload_file")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+# Body of the download/preview responses, serialised once since it never changes
+NO_STORED_OUTPUT_BODY = json.dumps({'error': 'The upscaled image is returned by the upload response for Vercel deployment'})
+
+def no_stored_output():
+    """Build the response for routes that need an output this app does not store"""
+    return Response(NO_STORED_OUTPUT_BODY, status=400, mimetype='application/json')
+
 @app.route('/download/<file_id>')
 def download_file(file_id):
-    """Download the upscaled image - returns base64 data"""
-    return jsonify({'error': 'Use the output_data from upload response for Vercel deployment'}), 400
+    """Download the upscaled image - not stored on Vercel"""
+    return no_stored_output()
 
 @app.route('/preview/<file_id>')
 def preview_file(file_id):
-    """Preview the upscaled image - returns base64 data"""
-    return jsonify({'error': 'Use the output_data from upload response for Vercel deployment'}), 400
+    """Preview the upscaled image - not stored on Vercel"""
+    return no_stored_output()
 
 @app.errorhandler(413)
 def too_large(e):
@@ -172,6 +189,4 @@ def internal_error(e):
 
 if __name__ == '__main__':
     print("Starting Vercel-optimized Image Upscaler...")
-    print(f"Temp upload dir: {temp_upload_dir}")
-    print(f"Temp output dir: {temp_output_dir}")
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,9 +1,9 @@
-from flask import Flask, request, jsonify, render_template
-import os
+from flask import Flask, Response, request, jsonify, render_template
 import uuid
+import json
 import time
 import base64
-import tempfile
+import mimetypes
 from ImageUpscalePython import ImageUpscaler
 from werkzeug.utils import secure_filename
 
@@ -12,10 +12,11 @@ app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25MB max file size
 
 # Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'}
+ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'))
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def allowed_file(filename, _allowed=ALLOWED_EXTENSIONS):
+    dot = filename.rfind('.')
+    return dot != -1 and filename[dot + 1:].lower() in _allowed
 
 @app.route('/')
 def index():
@@ -73,24 +74,15 @@ def upload_file():
         # Generate secure filename
         file_id = str(uuid.uuid4())
         file_ext = file.filename.rsplit('.', 1)[1].lower()
-        input_filename = f"{file_id}_input.{file_ext}"
         output_filename = f"{file_id}_output.{file_ext}"
         
-        # Create temp directory
-        temp_dir = tempfile.mkdtemp()
-        input_path = os.path.join(temp_dir, input_filename)
-        output_path = os.path.join(temp_dir, output_filename)
-        
-        # Save uploaded file
-        file.save(input_path)
-        
         # Initialize upscaler
         upscaler = ImageUpscaler()
         
-        # Upscale image
-        success = upscaler.upscale_image(
-            input_path=input_path,
-            output_path=output_path,
+        # Upscale in memory; the encoder output goes straight into the response
+        output_data = upscaler.upscale_bytes(
+            file.read(),
+            file_ext,
             scale_factor=scale_factor,
             target_width=target_width,
             target_height=target_height,
@@ -100,22 +92,19 @@ def upload_file():
         
         processing_duration = time.time() - start_time
         
-        if success and os.path.exists(output_path):
-            # Read the output file and convert to base64
-            with open(output_path, 'rb') as f:
-                output_data = f.read()
-            
-            # Convert to base64 for JSON response
+        if output_data is not None and request.args.get('format') != 'json':
+            # Send the image itself with the metadata in headers
+            response = Response(output_data, mimetype=mimetypes.guess_type(output_filename)[0])
+            response.headers.update({
+                'X-File-Id': file_id,
+                'X-Output-Filename': output_filename,
+                'X-Processing-Time': str(round(processing_duration, 2))
+            })
+            return response
+        elif output_data is not None:
+            # ?format=json: the image inlined as base64, for older clients
             output_base64 = base64.b64encode(output_data).decode('utf-8')
             
-            # Clean up files
-            try:
-                os.remove(input_path)
-                os.remove(output_path)
-                os.rmdir(temp_dir)
-            except:
-                pass  # Ignore cleanup errors
-            
             return jsonify({
                 'success': True,
                 'file_id': file_id,
@@ -127,29 +116,28 @@ def upload_file():
                 'download_url': f'/download/{file_id}'
             })
         else:
-            # Clean up uploaded file
-            try:
-                os.remove(input_path)
-                os.rmdir(temp_dir)
-            except:
-                pass
             return jsonify({'error': 'Failed to upscale image'}), 500
             
     except Exception as e:
-        print(f"Error in upload_file: {e}")
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("Exception in upload_file")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+# Body of the download/preview responses, serialised once since it never changes
+NO_STORED_OUTPUT_BODY = json.dumps({'error': 'Use the output_data from upload response'})
+
+def no_stored_output():
+    """Build the response for routes that need an output this app does not store"""
+    return Response(NO_STORED_OUTPUT_BODY, status=400, mimetype='application/json')
+
 @app.route('/download/<file_id>')
 def download_file(file_id):
     """Download the upscaled image - returns base64 data"""
-    return jsonify({'error': 'Use the output_data from upload response'}), 400
+    return no_stored_output()
 
 @app.route('/preview/<file_id>')
 def preview_file(file_id):
     """Preview the upscaled image - returns base64 data"""
-    return jsonify({'error': 'Use the output_data from upload response'}), 400
+    return no_stored_output()
 
 @app.errorhandler(413)
 def too_large(e):